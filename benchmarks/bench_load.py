@@ -0,0 +1,105 @@
+"""Benchmark Erddap.load() for a header-only consumer compared with a full consumer
+
+A header-only consumer (ex: monitor) only uses the datasetID, type and active
+attributes, a full consumer (ex: test) also uses the global and variables attributes.
+
+    python benchmarks/bench_load.py --datasets 1000 --variables 100
+"""
+
+import gc
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import click
+from loguru import logger
+
+from erddap_deploy.erddap import Erddap
+
+DATASET_TEMPLATE = """<dataset type="EDDTableFromNcFiles" datasetID="{dataset_id}" active="true">
+    <fileDir>/datasets/{dataset_id}/</fileDir>
+    <fileNameRegex>.*\\.nc</fileNameRegex>
+    <addAttributes>
+        <att name="cdm_data_type">TimeSeries</att>
+        <att name="title">Dataset {dataset_id}</att>
+        <att name="summary">Synthetic dataset {dataset_id}</att>
+    </addAttributes>
+{variables}
+</dataset>
+"""
+
+VARIABLE_TEMPLATE = """    <dataVariable>
+        <sourceName>var_{index}</sourceName>
+        <destinationName>var_{index}</destinationName>
+        <dataType>double</dataType>
+        <addAttributes>
+            <att name="ioos_category">Other</att>
+            <att name="long_name">Variable {index}</att>
+            <att name="units">m</att>
+        </addAttributes>
+    </dataVariable>"""
+
+
+def generate_catalog(path: Path, n_datasets: int, n_variables: int):
+    """Generate a datasets.d directory of synthetic datasets"""
+    variables = "\n".join(
+        VARIABLE_TEMPLATE.format(index=index) for index in range(n_variables)
+    )
+    datasets_d = path / "datasets.d"
+    datasets_d.mkdir()
+    for index in range(n_datasets):
+        dataset_id = f"dataset_{index}"
+        (datasets_d / f"{dataset_id}.xml").write_text(
+            DATASET_TEMPLATE.format(dataset_id=dataset_id, variables=variables)
+        )
+    return str(datasets_d / "*.xml")
+
+
+def header_consumer(erddap):
+    return [
+        (dataset.dataset_id, dataset.type, dataset.active)
+        for dataset in erddap.datasets.values()
+    ]
+
+
+def full_consumer(erddap):
+    return [
+        (dataset.attrs, [variable.attrs for variable in dataset.variables])
+        for dataset in erddap.datasets.values()
+    ]
+
+
+def run(datasets_xml: str, consumer, stream: bool):
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    erddap = Erddap(datasets_xml, stream=stream)
+    consumer(erddap)
+    duration = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+@click.command()
+@click.option("--datasets", default=1000, show_default=True, help="Number of datasets")
+@click.option(
+    "--variables", default=100, show_default=True, help="Variables per dataset"
+)
+def main(datasets, variables):
+    logger.remove()
+    with tempfile.TemporaryDirectory() as tmp:
+        datasets_xml = generate_catalog(Path(tmp), datasets, variables)
+        click.echo(f"{datasets} datasets x {variables} variables")
+        click.echo(f"{'consumer':<12}{'stream':<8}{'time (s)':>10}{'peak (MB)':>12}")
+        for name, consumer in (("header", header_consumer), ("full", full_consumer)):
+            for stream in (False, True):
+                duration, peak = run(datasets_xml, consumer, stream)
+                click.echo(
+                    f"{name:<12}{str(stream):<8}{duration:>10.3f}{peak / 1024**2:>12.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
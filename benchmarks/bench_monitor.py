@@ -0,0 +1,91 @@
+"""Benchmark the monitor reconciliation against an in-process fake uptime kuma
+
+Run the full monitor command on synthetic catalogs, a first time on an empty
+uptime kuma and a second time once every monitor exists, and report the
+number of API calls made and the wall time of each run.
+
+    python benchmarks/bench_monitor.py --datasets 100 --datasets 1000 --latency 0.001
+"""
+
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+import click
+from loguru import logger
+
+from erddap_deploy.erddap import Dataset
+from erddap_deploy.fake_uptime_kuma import FakeUptimeKumaApi
+from erddap_deploy.monitor import RetryPolicy, uptime_kuma_monitor
+
+
+def generate_datasets(n_datasets: int) -> list:
+    """Generate a list of synthetic datasets, one in ten being a realtime one"""
+    return [
+        Dataset(
+            ET.Element(
+                "dataset",
+                type="EDDGridFromNcFiles" if index % 2 else "EDDTableFromNcFiles",
+                datasetID=f"dataset_{index}{'_realtime' if index % 10 == 0 else ''}",
+                active="true",
+            )
+        )
+        for index in range(n_datasets)
+    ]
+
+
+def run(api, datasets, parallelism):
+    api.calls.clear()
+    start_time = time.perf_counter()
+    uptime_kuma_monitor(
+        None,
+        erddap_url="https://erddap.example.org/erddap",
+        datasets=datasets,
+        api=api,
+        parallelism=parallelism,
+        retry_policy=RetryPolicy(backoff=0),
+    )
+    return time.perf_counter() - start_time, Counter(api.calls)
+
+
+@click.command()
+@click.option(
+    "--datasets",
+    multiple=True,
+    type=int,
+    default=(100, 1000, 10000),
+    show_default=True,
+    help="Number of datasets of each catalog",
+)
+@click.option(
+    "--latency", default=0.0, show_default=True, help="Latency of each API call in s"
+)
+@click.option(
+    "--failure-rate",
+    default=0.0,
+    show_default=True,
+    help="Probability of an API call to time out",
+)
+@click.option(
+    "--parallelism", default=1, show_default=True, help="Operations run at once"
+)
+def main(datasets, latency, failure_rate, parallelism):
+    logger.remove()
+    click.echo(
+        f"{'datasets':>8} {'run':<8}{'time (s)':>10}{'calls':>8}  calls per method"
+    )
+    for n_datasets in datasets:
+        catalog = generate_datasets(n_datasets)
+        api = FakeUptimeKumaApi(latency=latency, failure_rate=failure_rate, seed=0)
+        for name in ("initial", "rerun"):
+            duration, calls = run(api, catalog, parallelism)
+            details = ", ".join(
+                f"{key}={value}" for key, value in sorted(calls.items())
+            )
+            click.echo(
+                f"{n_datasets:>8} {name:<8}{duration:>10.3f}{sum(calls.values()):>8}  {details}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from loguru import logger
+
+CACHE_VERSION = 4
+
+
+class ParseCache:
+    """On-disk cache of parsed datasets.xml files keyed by file path and content hash
+
+    Each file is stored as a json entry named after its path. An entry is only
+    returned if its content hash matches the one given, otherwise it is a miss.
+    Least recently used entries are evicted once the cache exceeds max_size bytes.
+    """
+
+    def __init__(self, cache_dir, max_size: int = 100 * 1024**2):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        return f"<ParseCache cache_dir={self.cache_dir} hits={self.hits} misses={self.misses}>"
+
+    def _get_entry_path(self, file) -> Path:
+        key = hashlib.sha256(str(Path(file).absolute()).encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, file, content_hash: str):
+        """Get cached data for a file if its content hash hasn't changed"""
+        entry_path = self._get_entry_path(file)
+        try:
+            entry = json.loads(entry_path.read_text(encoding="UTF-8"))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if entry.get("version") != CACHE_VERSION or entry.get("hash") != content_hash:
+            self.misses += 1
+            return None
+        # touch the entry to keep track of the least recently used ones
+        os.utime(entry_path)
+        self.hits += 1
+        return entry["data"]
+
+    def set(self, file, content_hash: str, data):
+        """Cache data for a file with its content hash"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+        entry_path = self._get_entry_path(file)
+        temp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(
+            json.dumps(
+                dict(
+                    version=CACHE_VERSION,
+                    path=str(file),
+                    hash=content_hash,
+                    data=data,
+                )
+            ),
+            encoding="UTF-8",
+        )
+        os.replace(temp_path, entry_path)
+
+    def evict(self):
+        """Remove least recently used entries until the cache is smaller than max_size"""
+        if not self.cache_dir.exists():
+            return
+        entries = sorted(
+            (stat.st_mtime, stat.st_size, entry)
+            for entry in self.cache_dir.glob("*.json")
+            for stat in [entry.stat()]
+        )
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            logger.debug("Evict cached {}", entry)
+            entry.unlink(missing_ok=True)
+            size -= entry_size
+
+    def clear(self):
+        """Remove every cached entry"""
+        if not self.cache_dir.exists():
+            return
+        logger.info("Clear parse cache {}", self.cache_dir)
+        for entry in self.cache_dir.glob("*.json"):
+            entry.unlink(missing_ok=True)
@@ -6,8 +6,10 @@ import click
 from dotenv import load_dotenv
 from loguru import logger
 
+from erddap_deploy.cache import ParseCache
 from erddap_deploy.erddap import Erddap
 from erddap_deploy.monitor import monitor
+from erddap_deploy.probe import probe
 from erddap_deploy.sync import sync
 from erddap_deploy.test import test
 
@@ -53,6 +55,64 @@ load_dotenv(".env")
     show_default=True,
     envvar="ERDDAP_bigParentDirectory",
 )
+@click.option(
+    "--stream",
+    help=(
+        "Release the content of each datasets.xml file once parsed to limit "
+        "memory usage, the parsed datasets are still kept in memory. Saved "
+        "datasets.xml are then generated from the parsed datasets."
+    ),
+    type=bool,
+    is_flag=True,
+    default=False,
+    envvar="ERDDAP_STREAM",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of workers used to read and parse datasets.xml files concurrently",
+    type=int,
+    default=1,
+    show_default=True,
+    envvar="ERDDAP_JOBS",
+)
+@click.option(
+    "--executor",
+    help=(
+        "Workers used with --jobs > 1: threads read and parse files, "
+        "process also parse files within a pool of processes"
+    ),
+    type=click.Choice(["thread", "process"]),
+    default="thread",
+    show_default=True,
+    envvar="ERDDAP_EXECUTOR",
+)
+@click.option(
+    "--cache-dir",
+    help=(
+        "Directory used to cache parsed datasets.xml files across runs "
+        "(ex: {bigParentDirectory}/erddap_deploy_cache). Cached content includes "
+        "the substituted secrets. Disabled if not provided."
+    ),
+    type=str,
+    default=None,
+    envvar="ERDDAP_CACHE_DIR",
+)
+@click.option(
+    "--cache-max-size",
+    help="Maximum size of the parse cache in MB",
+    type=float,
+    default=100,
+    show_default=True,
+    envvar="ERDDAP_CACHE_MAX_SIZE",
+)
+@click.option(
+    "--clear-cache",
+    help="Clear the parse cache before loading datasets.xml",
+    type=bool,
+    is_flag=True,
+    default=False,
+)
 @click.option(
     "--secrets",
     help=(
@@ -72,6 +132,12 @@ def cli(
     recursive,
     active_datasets_xml,
     big_parent_directory,
+    stream,
+    jobs,
+    executor,
+    cache_dir,
+    cache_max_size,
+    clear_cache,
     secrets,
 ):
     logger.debug("Run in debug mode")
@@ -96,9 +162,36 @@ def cli(
     if '"' in datasets_xml:
         logger.warning("datasets_xml contains quotes, make sure it's properly escaped")
 
-    erddap = Erddap(datasets_xml, recursive=recursive, secrets=secrets, lazy_load=True)
+    def get_cache():
+        if not cache_dir:
+            return None
+        return ParseCache(
+            cache_dir.format(bigParentDirectory=big_parent_directory),
+            max_size=int(cache_max_size * 1024**2),
+        )
+
+    if cache_dir and clear_cache:
+        get_cache().clear()
+
+    erddap = Erddap(
+        datasets_xml,
+        recursive=recursive,
+        secrets=secrets,
+        lazy_load=True,
+        stream=stream,
+        cache=get_cache(),
+        jobs=jobs,
+        executor=executor,
+    )
     logger.info("Load active datasets.xml")
-    active_erddap = Erddap(active_datasets_xml, secrets=secrets, lazy_load=True)
+    # active datasets.xml is only compared against, its content doesn't need to be retained
+    active_erddap = Erddap(
+        active_datasets_xml,
+        secrets=secrets,
+        lazy_load=True,
+        stream=True,
+        cache=get_cache(),
+    )
 
     if not active_erddap:
         logger.info(f"Active datasets.xml not found in {active_datasets_xml}")
@@ -131,6 +224,7 @@ def save(ctx, output):
 cli.add_command(test)
 cli.add_command(sync)
 cli.add_command(monitor)
+cli.add_command(probe)
 
 
 if __name__ == "__main__":
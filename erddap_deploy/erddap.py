@@ -1,16 +1,33 @@
-import difflib
+import hashlib
+import json
+import multiprocessing
 import os
+import re
+import stat
+import tempfile
+import time
 import xml.etree.ElementTree as ET
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import copy
+from functools import lru_cache
 from glob import glob
 from pathlib import Path
 from typing import Union
+from xml.sax.saxutils import escape, quoteattr
 
 import xarray as xr
 from loguru import logger
 
+from erddap_deploy.cache import ParseCache
+
+XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+ROOT_TAGS = re.compile(r"</?erddapDatasets\s*>")
+
 
 class Variable:
+    __slots__ = ("variable", "destination_name", "source_name", "data_type", "_attrs")
+
     @logger.catch(reraise=True)
     def __init__(self, variable):
         self.variable = variable
@@ -25,30 +42,76 @@ class Variable:
 
         data_type = self.variable.find("dataType")
         self.data_type = data_type.text.strip() if data_type is not None else None
-
-        self.attrs = self._get_attrs()
+        self._attrs = None
 
     def __repr__(self) -> str:
         return (
             f"<sourceName={self.source_name} destinationName={self.destination_name}>"
         )
 
+    @property
+    def attrs(self) -> dict:
+        """Variable attributes, retrieved on first access"""
+        if self._attrs is None:
+            self._attrs = self._get_attrs()
+        return self._attrs
+
     def _get_attrs(self):
         return {
             item.attrib["name"]: item.text
             for item in self.variable.findall(".//addAttributes/att")
         }
 
+    @classmethod
+    def from_record(cls, record: dict):
+        """Create a Variable from a cached record, the variable element isn't available"""
+        variable = cls.__new__(cls)
+        variable.variable = None
+        variable.destination_name = record["destinationName"]
+        variable.source_name = record["sourceName"]
+        variable.data_type = record["dataType"]
+        variable._attrs = record["attrs"]
+        return variable
+
+    def to_record(self) -> dict:
+        return dict(
+            destinationName=self.destination_name,
+            sourceName=self.source_name,
+            dataType=self.data_type,
+            attrs=self.attrs,
+        )
+
 
 class Dataset:
+    __slots__ = (
+        "_dataset",
+        "_xml",
+        "_digest",
+        "_structure_digest",
+        "_attrs",
+        "_variables",
+        "_variables_records",
+        "_indexes",
+        "source",
+        "type",
+        "dataset_id",
+        "active",
+    )
+
     @logger.catch(reraise=True)
-    def __init__(self, dataset: ET.Element):
-        self.dataset = dataset
+    def __init__(self, dataset: ET.Element, source: str = None):
+        self._dataset = dataset
+        self._xml = None
+        self._digest = None
+        self._structure_digest = None
+        self._attrs = None
+        self._variables = None
+        self._variables_records = None
+        self._indexes = {}
+        self.source = source
         self.type = self.dataset.attrib["type"]
         self.dataset_id = self.dataset.attrib["datasetID"]
         self.active = self.dataset.attrib.get("active", "true") == "true"
-        self.attrs = self._get_global_attributes()
-        self.variables = self._get_variables()
 
     def __repr__(self) -> str:
         return f"<datasetID={self.dataset_id}>"
@@ -61,6 +124,116 @@ class Dataset:
             return False
         return self.to_xml() == other.to_xml()
 
+    @property
+    def dataset(self) -> ET.Element:
+        """Dataset element, parsed on first access for datasets loaded from cache"""
+        if self._dataset is None:
+            self._dataset = element_fromstring(self._xml)
+        return self._dataset
+
+    @property
+    def attrs(self) -> dict:
+        """Global attributes, retrieved on first access"""
+        if self._attrs is None:
+            self._attrs = self._get_global_attributes()
+        return self._attrs
+
+    @property
+    def variables(self) -> list:
+        """Dataset variables, generated on first access"""
+        if self._variables is None and self._variables_records is not None:
+            self._variables = [
+                Variable.from_record(item) for item in self._variables_records
+            ]
+            self._variables_records = None
+        elif self._variables is None:
+            self._variables = self._get_variables()
+        return self._variables
+
+    @classmethod
+    def from_record(cls, record: dict, source: str = None):
+        """Create a Dataset from a cached record without parsing its xml"""
+        dataset = cls.__new__(cls)
+        dataset._dataset = None
+        dataset._xml = record["xml"]
+        dataset._digest = record["digest"]
+        dataset._structure_digest = record["structure_digest"]
+        dataset.source = source
+        dataset.type = record["type"]
+        dataset.dataset_id = record["datasetID"]
+        dataset.active = record["active"]
+        dataset._attrs = record["attrs"]
+        dataset._variables = None
+        dataset._variables_records = record["variables"]
+        dataset._indexes = {}
+        return dataset
+
+    def to_record(self) -> dict:
+        return dict(
+            datasetID=self.dataset_id,
+            type=self.type,
+            active=self.active,
+            attrs=self.attrs,
+            variables=[variable.to_record() for variable in self.variables],
+            xml=self.to_xml(),
+            digest=self.digest,
+            structure_digest=self.structure_digest,
+        )
+
+    @property
+    def digest(self) -> str:
+        """Hash of the dataset canonical xml, which ignores whitespace and attributes order"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(
+                canonical_xml(self.dataset).encode("UTF-8")
+            ).hexdigest()
+        return self._digest
+
+    @property
+    def structure_digest(self) -> str:
+        """Hash of the dataset canonical xml without the global and variables addAttributes
+
+        It is unchanged by metadata only changes.
+        """
+        if self._structure_digest is None:
+            self._structure_digest = hashlib.sha256(
+                canonical_xml(self.dataset, exclude=("addAttributes",)).encode("UTF-8")
+            ).hexdigest()
+        return self._structure_digest
+
+    def compare(self, other: "Dataset") -> list:
+        """List the changes of each element needed to go from the other dataset to this one
+
+        Each change is a dictionary with the changed element ("dataset" attributes,
+        global "addAttributes", "axisVariable", "dataVariable", the variables
+        addAttributes as "dataVariable/addAttributes" or any other dataset child
+        tag), its name, the action (added, removed or changed) and the old and
+        new values.
+        """
+        changes = _compare_values("dataset", other.dataset.attrib, self.dataset.attrib)
+        changes += _compare_values(
+            "addAttributes",
+            _get_attributes(other.dataset.find("addAttributes")),
+            _get_attributes(self.dataset.find("addAttributes")),
+        )
+
+        for tag in ("axisVariable", "dataVariable"):
+            changes += _compare_variables(
+                tag,
+                _get_variables_elements(other.dataset, tag),
+                _get_variables_elements(self.dataset, tag),
+            )
+
+        old_children = _get_children(other.dataset)
+        new_children = _get_children(self.dataset)
+        for tag in {**old_children, **new_children}:
+            changes += _compare_values(
+                tag,
+                {tag: old_children[tag]} if tag in old_children else {},
+                {tag: new_children[tag]} if tag in new_children else {},
+            )
+        return changes
+
     def _get_global_attributes(self):
         return {
             item.attrib["name"]: item.text
@@ -81,7 +254,9 @@ class Dataset:
         return xr.Dataset(vars=vars, attrs=self.attrs)
 
     def to_xml(self, output=None):
-        return ET.tostring(self.dataset).decode("UTF-8")
+        if self._dataset is None:
+            return self._xml
+        return ET.tostring(self._dataset, encoding="unicode")
 
     def get_variables_destination_names(self):
         return [var.destination_name or var.source_name for var in self.variables]
@@ -89,6 +264,31 @@ class Dataset:
     def get_variables_source_names(self):
         return [var.source_name for var in self.variables]
 
+    def _get_index(self, name: str, get_key) -> dict:
+        if name not in self._indexes:
+            self._indexes[name] = {get_key(var): var for var in self.variables}
+        return self._indexes[name]
+
+    @property
+    def variables_by_destination_name(self) -> dict:
+        """Variables indexed by destination name (or source name if not defined)"""
+        return self._get_index(
+            "destination_name", lambda var: var.destination_name or var.source_name
+        )
+
+    @property
+    def variables_by_source_name(self) -> dict:
+        """Variables indexed by source name"""
+        return self._get_index("source_name", lambda var: var.source_name)
+
+    @property
+    def variables_by_lower_destination_name(self) -> dict:
+        """Variables indexed by lower case destination name (or source name if not defined)"""
+        return self._get_index(
+            "lower_destination_name",
+            lambda var: (var.destination_name or var.source_name or "").lower(),
+        )
+
 
 class Erddap:
     def __init__(
@@ -99,16 +299,28 @@ class Erddap:
         encoding: str = "UTF-8",
         recursive: bool = True,
         lazy_load: bool = False,
+        stream: bool = False,
+        cache: ParseCache = None,
+        jobs: int = 1,
+        executor: str = "thread",
     ):
         self.datasets_xml_dir = datasets_xml_dir
         self.setup_xml_dir = setup_xml_dir
         self.recursive = recursive
         self.encoding = encoding
+        self.stream = stream
+        self.cache = cache
+        self.jobs = jobs
+        self.executor = executor
+        self._parse_pool = None
         self.secrets = {**self._get_env_secrets(), **(secrets or {})}
         self.datasets_xml = None
         self.setup = None
-        self.tree = None
+        self._tree = None
+        self.nodes = []
         self.datasets = {}
+        self.partial = False
+        self._file_nodes = {}
         if not lazy_load:
             self.load()
 
@@ -127,8 +339,8 @@ class Erddap:
         logger.debug("Found Environment Variables Secrets: {}", list(secrets.keys()))
         return secrets
 
-    def _load_datasets_xml(self):
-        """Load datasets.xml from dataset_xml_dir and wrap it in <erddapDatasets> if necessary"""
+    def get_xml_files(self, verbose: bool = True):
+        """Get the sorted list of files matching the first datasets_xml_dir search path"""
         search_path = [
             search
             for search in self.datasets_xml_dir.split("|")
@@ -140,122 +352,531 @@ class Erddap:
                 self.datasets_xml_dir.split("|"),
                 self.recursive,
             )
-            return
-        xml_files = [files for files in glob(search_path[0], recursive=self.recursive)]
-        logger.info(
+            return []
+        xml_files = sorted(glob(search_path[0], recursive=self.recursive))
+        logger.log(
+            "INFO" if verbose else "DEBUG",
             "Found {} files matching datasets.xml with search path {}: {}",
             len(xml_files),
             search_path[0],
             xml_files,
         )
-        datasets_xml = "\n".join(
-            [Path(file).read_text(encoding=self.encoding) for file in xml_files]
+        return xml_files
+
+    def _get_content_hash(self, text: str) -> str:
+        """Hash a file content along with the secrets substituted in it"""
+        content_hash = hashlib.sha256(text.encode("UTF-8"))
+        content_hash.update(json.dumps(self.secrets, sort_keys=True).encode("UTF-8"))
+        return content_hash.hexdigest()
+
+    def _load_xml_file(self, file, parse: bool = True, retain_text: bool = None):
+        """Read a datasets.xml file, replace its secrets and parse its top level elements
+
+        The returned text is None for cached files if retain_text is false,
+        which defaults to not stream.
+        """
+        if retain_text is None:
+            retain_text = not self.stream
+        text = Path(file).read_text(encoding=self.encoding)
+        if not parse:
+            text, counts = replace_secrets(text, self.secrets)
+            return text, [], counts
+        if self.cache is None:
+            text, counts = replace_secrets(text, self.secrets)
+            return text, self._parse_xml(text, file), counts
+
+        content_hash = self._get_content_hash(text)
+        cached = self.cache.get(file, content_hash)
+        if cached is not None:
+            nodes = [
+                node_from_record(record, source=file) for record in cached["nodes"]
+            ]
+            counts = Counter(cached["secrets"])
+            text = replace_secrets(text, self.secrets)[0] if retain_text else None
+            return text, nodes, counts
+
+        text, counts = replace_secrets(text, self.secrets)
+        nodes = self._parse_xml(text, file)
+        self.cache.set(
+            file,
+            content_hash,
+            dict(nodes=[node_to_record(node) for node in nodes], secrets=counts),
         )
-        if (
-            "<erddapDatasets>" not in datasets_xml
-            and "</erddapDatasets>" not in datasets_xml
-        ):
-            datasets_xml = f'<?xml version="1.0" encoding="{self.encoding}"?><erddapDatasets>{datasets_xml}</erddapDatasets>'
+        return text, nodes, counts
+
+    def _parse_xml(self, text: str, file):
+        """Parse a file content, within the process pool if available"""
+        if self._parse_pool is None:
+            return parse_datasets_xml(text, source=file)
+        return self._parse_pool.submit(parse_datasets_xml, text, file).result()
+
+    def _iter_xml_files(
+        self, xml_files: list, parse_only: set = None, retain_text: bool = None
+    ):
+        """Load xml files and yield their content in order
+
+        With jobs > 1, files are read by a pool of threads and, if executor="process",
+        parsed by a pool of processes. Only a few files ahead of the one yielded are
+        loaded at once to keep memory usage bounded. If parse_only is given, only
+        those files are parsed, the others are only read.
+        """
 
-        self.datasets_xml = datasets_xml
+        def load_xml_file(file):
+            parse = parse_only is None or Path(file).resolve() in parse_only
+            return self._load_xml_file(file, parse=parse, retain_text=retain_text)
 
-    def _replace_secrets(self):
-        """Replace secrets in the datasets_xml"""
-        for key, value in self.secrets.items():
-            if key in self.datasets_xml:
-                count = self.datasets_xml.count(key)
-                logger.debug("Replace {} x {}", count, key)
-                self.datasets_xml = self.datasets_xml.replace(key, value)
+        if self.jobs <= 1:
+            yield from map(load_xml_file, xml_files)
+            return
+
+        if self.executor == "process":
+            # processes are started from the reading threads, avoid forking them
+            start_method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            self._parse_pool = ProcessPoolExecutor(
+                self.jobs, mp_context=multiprocessing.get_context(start_method)
+            )
+        elif self.executor != "thread":
+            raise ValueError(f"Unknown executor {self.executor}")
+        try:
+            with ThreadPoolExecutor(self.jobs) as thread_pool:
+                futures = deque()
+                for file in xml_files:
+                    futures.append(thread_pool.submit(load_xml_file, file))
+                    if len(futures) >= 2 * self.jobs:
+                        yield futures.popleft().result()
+                while futures:
+                    yield futures.popleft().result()
+        finally:
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(cancel_futures=True)
+                self._parse_pool = None
+
+    def _log_secrets(self, counts: Counter):
+        for key in self.secrets:
+            if counts[key]:
+                logger.debug("Replace {} x {}", counts[key], key)
             else:
                 logger.warning("Secret {} not found in datasets.xml", key)
 
-    def _parse_datasets(self):
-        """Parse datasets.xml and return the tree"""
-        try:
-            self.tree = ET.fromstring(self.datasets_xml)
-        except ET.ParseError as e:
-            raise ValueError("Failed to parse datasets.xml: {}", e)
+    @property
+    def tree(self) -> ET.Element:
+        """Loaded top level elements wrapped in <erddapDatasets>, built on first access
 
-    def _get_datasets(self):
-        if self.tree is None:
-            raise ValueError("No datasets.xml parsed")
-        self.datasets = {
-            item.attrib["datasetID"]: Dataset(item)
-            for item in self.tree.findall("dataset")
-        }
+        Datasets loaded from the parse cache are only parsed then. The tree
+        isn't available in stream mode.
+        """
+        if self._tree is None and not self.stream and self.datasets_xml is not None:
+            self._tree = self._build_tree()
+        return self._tree
+
+    def _build_tree(self):
+        """Wrap the loaded top level elements in <erddapDatasets>"""
+        tree = ET.Element("erddapDatasets")
+        tree.extend(
+            node.dataset if isinstance(node, Dataset) else node for node in self.nodes
+        )
+        return tree
+
+    def iter_datasets(self):
+        """Yield datasets one file at a time without retaining the files content"""
+        counts = Counter()
+        for _, nodes, file_counts in self._iter_xml_files(self.get_xml_files()):
+            counts.update(file_counts)
+            yield from (node for node in nodes if isinstance(node, Dataset))
+        self._log_secrets(counts)
 
     @logger.catch(reraise=True)
-    def load(self):
-        """Load datasets.xml file(s), add secrets and parse it into a dictionary of Dataset objects"""
-        self._load_datasets_xml()
-        if self.datasets_xml is None:
+    def load(self, parse_only: set = None):
+        """Load datasets.xml file(s), add secrets and parse it into a dictionary of Dataset objects
+
+        Each file is parsed on its own. In stream mode, the files content is released
+        once parsed and neither datasets_xml nor tree are retained, the parsed
+        datasets are still kept in datasets (use iter_datasets to go through
+        them without retaining them). Files loaded
+        concurrently (jobs > 1) are merged in the same order as a serial load.
+
+        Args:
+            parse_only (set): Resolved paths of the only files to parse. The
+                datasets of the other files are kept from the previous load, so
+                that the parsed catalog is only updated with the changed files,
+                and are missing from datasets if they weren't loaded before
+                (partial is then True until the next full load). Their content is always retained in datasets_xml.
+        """
+        start_time = time.perf_counter()
+        xml_files = self.get_xml_files()
+        if not xml_files:
             logger.warning(
                 "No datasets.xml file(s) found for: {}, recursive={}",
                 self.datasets_xml_dir,
                 self.recursive,
             )
             return
-        self._replace_secrets()
-        self._parse_datasets()
-        self._get_datasets()
-        logger.info("Loaded {} datasets", len(self.datasets.keys()))
+
+        if parse_only is not None:
+            parse_only = {Path(file).resolve() for file in parse_only}
+        retain_texts = not self.stream or parse_only is not None
+        # the catalog is only replaced once all the files are loaded, so that
+        # it's kept as is if any of them fails to parse
+        texts, counts, all_nodes, file_nodes = [], Counter(), [], {}
+        partial = False
+        for file, (text, nodes, file_counts) in zip(
+            xml_files,
+            self._iter_xml_files(xml_files, parse_only, retain_text=retain_texts),
+        ):
+            if parse_only is not None and Path(file).resolve() not in parse_only:
+                partial = partial or file not in self._file_nodes
+                nodes = self._file_nodes.get(file, [])
+            if retain_texts:
+                texts.append(text)
+            file_nodes[file] = nodes
+            all_nodes.extend(nodes)
+            counts.update(file_counts)
+        self._log_secrets(counts)
+
+        self.nodes, self._file_nodes, self.partial = all_nodes, file_nodes, partial
+        self.datasets = {
+            node.dataset_id: node for node in self.nodes if isinstance(node, Dataset)
+        }
+        if retain_texts:
+            self.datasets_xml = wrap_datasets_xml("\n".join(texts), self.encoding)
+        self._tree = None
+
+        if self.cache is None:
+            logger.info(
+                "Loaded {} datasets in {:.3f}s",
+                len(self.datasets.keys()),
+                time.perf_counter() - start_time,
+            )
+            return self
+        self.cache.evict()
+        logger.info(
+            "Loaded {} datasets in {:.3f}s (parse cache hits={} misses={})",
+            len(self.datasets.keys()),
+            time.perf_counter() - start_time,
+            self.cache.hits,
+            self.cache.misses,
+        )
         return self
 
     @logger.catch
     def diff(self, other):
-        """Compare two Erddap objects and return a list of datasets that are different"""
+        """Compare two Erddap objects and return the changes of each dataset that is different
+
+        Datasets are compared by their canonical digest and a structured list of
+        changes (see Dataset.compare) is only generated for the ones that differ.
+        Datasets missing from self or other are reported as a single
+        removed/added "dataset" change.
+        """
         other_erddap = other if isinstance(other, Erddap) else Erddap(other)
-        datasetIDs = set(self.datasets.keys()) | set(other_erddap.datasets.keys())
         differences = {}
-        for datasetID in datasetIDs:
+        for datasetID, dataset in self.datasets.items():
+            other_dataset = other_erddap.datasets.get(datasetID)
+            if other_dataset is None:
+                differences[datasetID] = [
+                    dict(element="dataset", name=datasetID, action="added")
+                ]
+            elif dataset.digest != other_dataset.digest:
+                differences[datasetID] = dataset.compare(other_dataset)
+        for datasetID in other_erddap.datasets:
             if datasetID not in self.datasets:
-                differences[datasetID] = f"{datasetID} not in self"
-            elif datasetID not in other_erddap.datasets:
-                differences[datasetID] = f"{datasetID} not in other"
-            elif (
-                self.datasets.get(datasetID).to_xml()
-                != other_erddap.datasets.get(datasetID).to_xml()
-            ):
-                differences[datasetID] = difflib.context_diff(
-                    str(self.datasets.get(datasetID)),
-                    str(other_erddap.datasets.get(datasetID)),
-                )
+                differences[datasetID] = [
+                    dict(element="dataset", name=datasetID, action="removed")
+                ]
         return differences
 
-    @logger.catch
-    def save(
-        self, output: Union[str, Path], source: str = "original", encoding: str = None
-    ):
+    @logger.catch(reraise=True)
+    def save(self, output: Union[str, Path], source: str = None, encoding: str = None):
         """Write datasets.xml to a file
 
+        The content is streamed to a temporary file next to the output, which then
+        atomically replaces it. The output is left untouched if its content is unchanged.
+
         Args:
             output (str): Path to the output file
-            source (str): Source of the datasets.xml. Can be "original" or "parsed"
+            source (str): Source of the datasets.xml. Can be "original" or "parsed".
+                Default to "original" unless loaded in stream mode.
             encoding (str): Encoding of the output file
+
+        Returns:
+            bool: True if the output file was written
         """
         encoding = encoding or self.encoding
+        source = source or ("parsed" if self.stream else "original")
 
-        if self.datasets_xml is None:
+        if self.datasets_xml is None and not self.nodes:
             return logger.warning("No datasets.xml to save")
         elif source == "original":
+            if self.datasets_xml is None:
+                raise ValueError(
+                    "Original datasets.xml is not retained when loaded in stream mode"
+                )
             if encoding and encoding != self.encoding:
                 raise ValueError(
                     f"Cannot change encoding from {self.encoding} to {encoding} when source is original"
                 )
 
-            Path(output).write_text(self.datasets_xml, encoding=self.encoding)
+            return write_atomic(output, [self.datasets_xml], encoding=self.encoding)
         elif source == "parsed":
-            Path(output).write_text(
-                f'<?xml version="1.0" encoding="{encoding}"?>\n'
-                + ET.tostring(self.tree, encoding=encoding).decode(encoding),
-                encoding=encoding,
+            return write_atomic(output, self._iter_parsed_xml(encoding), encoding)
+        raise ValueError(f"Unknown source {source}")
+
+    def _iter_parsed_xml(self, encoding: str):
+        """Serialize the loaded top level elements one at a time"""
+        yield f'<?xml version="1.0" encoding="{encoding}"?>\n<erddapDatasets>'
+        for node in self.nodes:
+            yield (
+                node.to_xml()
+                if isinstance(node, Dataset)
+                else ET.tostring(node, encoding="unicode")
             )
+        yield "</erddapDatasets>"
 
     def copy(self):
         """Get a copy of the Erddap object"""
         return copy(self)
 
 
+def hash_file(path: Union[str, Path], chunk_size: int = 1024**2) -> str:
+    """Hash a file content without loading it fully in memory"""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def write_atomic(output: Union[str, Path], chunks, encoding: str = "UTF-8") -> bool:
+    """Stream text chunks to a temporary file next to output and atomically replace output
+
+    The temporary file is synced to disk before replacing output, and discarded if
+    its content is identical to the existing output. Return True if output was written.
+    """
+    output = Path(output)
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=output.parent, prefix=f".{output.name}.", suffix=".tmp", delete=False
+    ) as file:
+        try:
+            for chunk in chunks:
+                data = chunk.encode(encoding, errors="xmlcharrefreplace")
+                content_hash.update(data)
+                file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.close()
+            os.unlink(file.name)
+            raise
+
+    if output.exists():
+        if hash_file(output) == content_hash.hexdigest():
+            logger.info("{} is unchanged", output)
+            os.unlink(file.name)
+            return False
+        # keep the permissions and ownership of the replaced file
+        output_stat = output.stat()
+        os.chmod(file.name, stat.S_IMODE(output_stat.st_mode))
+        try:
+            os.chown(file.name, output_stat.st_uid, output_stat.st_gid)
+        except (AttributeError, PermissionError):
+            pass
+    else:
+        os.chmod(file.name, 0o644)
+
+    os.replace(file.name, output)
+    logger.debug("Saved {}", output)
+    return True
+
+
+def replace_secrets(text: str, secrets: dict):
+    """Replace secrets in text and return the new text and the count of each secret
+
+    Every secret is replaced in a single pass over the text. Longer secrets are
+    matched first so that overlapping keys are replaced predictably.
+    """
+    counts = Counter()
+    keys = tuple(key for key in secrets if key)
+    if not keys:
+        return text, counts
+
+    def replace(match):
+        counts[match.group(0)] += 1
+        return secrets[match.group(0)]
+
+    return get_secrets_pattern(keys).sub(replace, text), counts
+
+
+@lru_cache(maxsize=8)
+def get_secrets_pattern(keys: tuple) -> re.Pattern:
+    """Compile an alternation of the secrets keys, longest first"""
+    return re.compile(
+        "|".join(re.escape(key) for key in sorted(keys, key=len, reverse=True))
+    )
+
+
+def canonical_xml(element: ET.Element, exclude: tuple = ()) -> str:
+    """Serialize an element with sorted attributes, stripped text and without tails
+
+    Children with a tag listed in exclude are ignored at any depth.
+    """
+    attrs = "".join(
+        f" {key}={quoteattr(value)}" for key, value in sorted(element.attrib.items())
+    )
+    text = escape((element.text or "").strip())
+    children = "".join(
+        canonical_xml(child, exclude) for child in element if child.tag not in exclude
+    )
+    return f"<{element.tag}{attrs}>{text}{children}</{element.tag}>"
+
+
+def _compare_values(element: str, old: dict, new: dict) -> list:
+    """List the values added, removed or changed between two dictionaries"""
+    changes = []
+    for name in {**old, **new}:
+        if name in old and name in new and old[name] == new[name]:
+            continue
+        action = (
+            "added" if name not in old else "removed" if name not in new else "changed"
+        )
+        changes.append(
+            dict(
+                element=element,
+                name=name,
+                action=action,
+                old=old.get(name),
+                new=new.get(name),
+            )
+        )
+    return changes
+
+
+def _compare_variables(tag: str, old_variables: dict, new_variables: dict) -> list:
+    """List the changes of the variables (tag) and of their addAttributes"""
+    changes = []
+    for name in {**old_variables, **new_variables}:
+        old_variable, new_variable = old_variables.get(name), new_variables.get(name)
+        if old_variable is None or new_variable is None:
+            changes += _compare_values(
+                tag,
+                (
+                    {name: canonical_xml(old_variable)}
+                    if old_variable is not None
+                    else {}
+                ),
+                (
+                    {name: canonical_xml(new_variable)}
+                    if new_variable is not None
+                    else {}
+                ),
+            )
+            continue
+        changes += _compare_values(
+            tag,
+            _get_children(old_variable, prefix=f"{name}/"),
+            _get_children(new_variable, prefix=f"{name}/"),
+        )
+        changes += _compare_values(
+            f"{tag}/addAttributes",
+            _get_attributes(old_variable.find("addAttributes"), prefix=f"{name}/"),
+            _get_attributes(new_variable.find("addAttributes"), prefix=f"{name}/"),
+        )
+    return changes
+
+
+def _get_attributes(add_attributes: ET.Element, prefix: str = "") -> dict:
+    if add_attributes is None:
+        return {}
+    return {
+        prefix + item.attrib["name"]: item.text
+        for item in add_attributes.findall("att")
+    }
+
+
+def _get_variables_elements(dataset: ET.Element, tag: str = "dataVariable") -> dict:
+    return {
+        (
+            variable.findtext("destinationName")
+            or variable.findtext("sourceName")
+            or ""
+        ).strip(): variable
+        for variable in dataset.findall(tag)
+    }
+
+
+def _get_children(element: ET.Element, prefix: str = "") -> dict:
+    """Canonical value of the element children other than addAttributes and variables"""
+    children = {}
+    for child in element:
+        if child.tag in ("addAttributes", "axisVariable", "dataVariable"):
+            continue
+        value = (
+            (child.text or "").strip()
+            if not len(child) and not child.attrib
+            else canonical_xml(child)
+        )
+        name = prefix + child.tag
+        children[name] = f"{children[name]}\n{value}" if name in children else value
+    return children
+
+
+def element_fromstring(xml: str) -> ET.Element:
+    """Parse a serialized element and keep its trailing whitespace as tail"""
+    element = ET.fromstring(xml)
+    element.tail = xml[len(xml.rstrip()) :] or None
+    return element
+
+
+def node_to_record(node) -> dict:
+    """Convert a top level element of datasets.xml to a json serializable record"""
+    if isinstance(node, Dataset):
+        return node.to_record()
+    return dict(xml=ET.tostring(node, encoding="unicode"))
+
+
+def node_from_record(record: dict, source: str = None):
+    """Convert a record generated by node_to_record back to a top level element"""
+    if "datasetID" in record:
+        return Dataset.from_record(record, source=source)
+    return element_fromstring(record["xml"])
+
+
+def wrap_datasets_xml(datasets_xml: str, encoding: str = "UTF-8"):
+    """Wrap datasets.xml content in <erddapDatasets> if necessary"""
+    if "<erddapDatasets>" in datasets_xml or "</erddapDatasets>" in datasets_xml:
+        return datasets_xml
+    return f'<?xml version="1.0" encoding="{encoding}"?><erddapDatasets>{datasets_xml}</erddapDatasets>'
+
+
+def parse_datasets_xml(datasets_xml: str, source: str = None):
+    """Parse a datasets.xml file or fragment and return its top level elements
+    with each <dataset> converted to a Dataset object
+
+    A fragment may open or close the <erddapDatasets> root element without the
+    other, as done by datasets.d layouts starting the root element in their
+    first file and ending it in their last one.
+    """
+    if ("<erddapDatasets>" in datasets_xml) != ("</erddapDatasets>" in datasets_xml):
+        datasets_xml = ROOT_TAGS.sub("", datasets_xml)
+    if (
+        "<erddapDatasets>" not in datasets_xml
+        and "</erddapDatasets>" not in datasets_xml
+    ):
+        datasets_xml = (
+            f"<erddapDatasets>{XML_DECLARATION.sub('', datasets_xml)}</erddapDatasets>"
+        )
+    try:
+        tree = ET.fromstring(datasets_xml)
+    except ET.ParseError as e:
+        raise ValueError(f"Failed to parse {source or 'datasets.xml'}: {e}")
+    return [
+        Dataset(item, source=source) if item.tag == "dataset" else item for item in tree
+    ]
+
+
 # https://cfconventions.org/Data/cf-conventions/cf-conventions-1.8/cf-conventions.html#discrete-sampling-geometries
 CDM_DATA_TYPES = (
     "Grid",
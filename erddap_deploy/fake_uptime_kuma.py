@@ -0,0 +1,166 @@
+import copy
+import random
+import threading
+import time
+from collections import Counter
+
+from uptime_kuma_api import exceptions
+
+
+class FakeUptimeKumaApi:
+    """In-process stand-in for UptimeKumaApi used to test and benchmark the monitor command
+
+    Monitors and status pages are kept in memory. Every call sleeps latency
+    seconds and fails with an uptime_kuma_api Timeout with a probability of
+    failure_rate (only for the methods listed in fail_methods if given).
+    With lost_responses, the calls changing monitors or status pages fail
+    after taking effect, like a response lost on its way back. The number of
+    calls made to each method is available in calls.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        fail_methods: tuple = None,
+        seed: int = None,
+        lost_responses: bool = False,
+    ):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_methods = fail_methods
+        self.lost_responses = lost_responses
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.monitors = {}
+        self.status_pages = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
+
+    def _call(self, method: str, changes: bool = False) -> bool:
+        """Count a call and inject its failure, return True if its response is lost"""
+        with self.lock:
+            self.calls[method] += 1
+            fail = (
+                self.fail_methods is None or method in self.fail_methods
+            ) and self.random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail and changes and self.lost_responses:
+            return True
+        if fail:
+            raise exceptions.Timeout(f"Injected {method} failure")
+        return False
+
+    @staticmethod
+    def _respond(method: str, lost: bool, response: dict) -> dict:
+        if lost:
+            raise exceptions.Timeout(f"Injected {method} lost response")
+        return response
+
+    def _get_monitor(self, id_: int) -> dict:
+        if id_ not in self.monitors:
+            raise exceptions.UptimeKumaException("Monitor not found")
+        return self.monitors[id_]
+
+    def login(self, username: str = None, password: str = None, token: str = None):
+        self._call("login")
+        return {}
+
+    def disconnect(self):
+        pass
+
+    def get_monitors(self) -> list:
+        self._call("get_monitors")
+        with self.lock:
+            return copy.deepcopy(list(self.monitors.values()))
+
+    def get_monitor(self, id_: int) -> dict:
+        self._call("get_monitor")
+        with self.lock:
+            return copy.deepcopy(self._get_monitor(id_))
+
+    def add_monitor(self, **kwargs) -> dict:
+        lost = self._call("add_monitor", changes=True)
+        with self.lock:
+            id_ = self.next_id
+            self.next_id += 1
+            parent = kwargs.get("parent")
+            path_name = kwargs["name"]
+            if parent is not None:
+                path_name = f"{self._get_monitor(parent)['pathName']} / {path_name}"
+            self.monitors[id_] = {
+                "url": None,
+                **kwargs,
+                "id": id_,
+                "parent": parent,
+                "pathName": path_name,
+                "active": True,
+            }
+        return self._respond(
+            "add_monitor", lost, {"msg": "Added Successfully.", "monitorID": id_}
+        )
+
+    def edit_monitor(self, id_: int, **kwargs) -> dict:
+        lost = self._call("edit_monitor", changes=True)
+        with self.lock:
+            self._get_monitor(id_).update(kwargs)
+        return self._respond("edit_monitor", lost, {"msg": "Saved.", "monitorID": id_})
+
+    def pause_monitor(self, id_: int) -> dict:
+        lost = self._call("pause_monitor", changes=True)
+        with self.lock:
+            self._get_monitor(id_)["active"] = False
+        return self._respond("pause_monitor", lost, {"msg": "Paused Successfully."})
+
+    def resume_monitor(self, id_: int) -> dict:
+        lost = self._call("resume_monitor", changes=True)
+        with self.lock:
+            self._get_monitor(id_)["active"] = True
+        return self._respond("resume_monitor", lost, {"msg": "Resumed Successfully."})
+
+    def delete_monitor(self, id_: int) -> dict:
+        lost = self._call("delete_monitor", changes=True)
+        with self.lock:
+            self._get_monitor(id_)
+            del self.monitors[id_]
+        return self._respond("delete_monitor", lost, {"msg": "Deleted Successfully."})
+
+    def get_status_pages(self) -> list:
+        self._call("get_status_pages")
+        with self.lock:
+            return [
+                dict(slug=slug, title=page["title"])
+                for slug, page in self.status_pages.items()
+            ]
+
+    def get_status_page(self, slug: str) -> dict:
+        self._call("get_status_page")
+        with self.lock:
+            if slug not in self.status_pages:
+                raise exceptions.UptimeKumaException("Status page not found")
+            return copy.deepcopy(self.status_pages[slug])
+
+    def add_status_page(self, slug: str, title: str) -> dict:
+        lost = self._call("add_status_page", changes=True)
+        with self.lock:
+            self.status_pages[slug] = dict(slug=slug, title=title, publicGroupList=[])
+        return self._respond("add_status_page", lost, {"msg": "Added Successfully."})
+
+    def save_status_page(self, slug: str, **kwargs) -> dict:
+        lost = self._call("save_status_page", changes=True)
+        with self.lock:
+            if slug not in self.status_pages:
+                raise exceptions.UptimeKumaException("Status page not found")
+            self.status_pages[slug].update(copy.deepcopy(kwargs))
+            return self._respond(
+                "save_status_page",
+                lost,
+                dict(publicGroupList=copy.deepcopy(kwargs.get("publicGroupList"))),
+            )
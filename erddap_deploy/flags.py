@@ -0,0 +1,137 @@
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from loguru import logger
+
+# Changes ERDDAP can apply by reloading the dataset without its cached files
+METADATA_ELEMENTS = (
+    "addAttributes",
+    "axisVariable/addAttributes",
+    "dataVariable/addAttributes",
+)
+
+
+def get_flag_type(changes: list) -> str:
+    """Get the flag needed to apply a dataset changes
+
+    Metadata only changes (global or variables addAttributes) only need a soft
+    flag, which reloads the dataset. This matches the changes ignored by
+    Dataset.structure_digest. Any other change (ex: fileDir,
+    fileNameRegex, dataVariable) or unknown changes need a hard flag, which also
+    discards the dataset cached files.
+    """
+    if changes and all(change["element"] in METADATA_ELEMENTS for change in changes):
+        return "soft"
+    return "hard"
+
+
+class FlagScheduler:
+    """Release soft and hard flags in batches to avoid reloading every dataset at once
+
+    Flags are sorted by priority: soft flags first, then by the index of the
+    first priority prefix matching the dataset type and by number of variables,
+    smaller datasets first. Each batch of batch_size flags is written
+    interval seconds after the previous one. If wait is enabled, the next batch
+    is only written once ERDDAP consumed (deleted) the flags of the previous
+    one and status_url responds, or timeout seconds elapsed.
+    """
+
+    def __init__(
+        self,
+        flag_dir: Path = None,
+        hard_flag_dir: Path = None,
+        batch_size: int = None,
+        interval: float = 0,
+        priority: list = None,
+        wait: bool = False,
+        status_url: str = None,
+        timeout: float = 600,
+        poll_interval: float = 5,
+    ):
+        self.flag_dir = flag_dir
+        self.hard_flag_dir = hard_flag_dir
+        self.batch_size = batch_size
+        self.interval = interval
+        self.priority = priority or []
+        self.wait = wait
+        self.status_url = status_url
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def get_priority(self, flag_type: str, dataset) -> tuple:
+        dataset_type = dataset.type if dataset else ""
+        type_priority = next(
+            (
+                index
+                for index, prefix in enumerate(self.priority)
+                if dataset_type.startswith(prefix)
+            ),
+            len(self.priority),
+        )
+        size = len(dataset.variables) if dataset else 0
+        return (flag_type != "soft", type_priority, size)
+
+    def schedule(self, diff: dict, datasets: dict = None, force_hard=False) -> list:
+        """Sort the flags by priority and split them in batches of (flag_type, datasetID)"""
+        datasets = datasets or {}
+        flags = sorted(
+            (
+                ("hard" if force_hard else get_flag_type(changes), dataset_id)
+                for dataset_id, changes in diff.items()
+            ),
+            key=lambda flag: self.get_priority(flag[0], datasets.get(flag[1])),
+        )
+        size = self.batch_size or len(flags) or 1
+        return [flags[index : index + size] for index in range(0, len(flags), size)]
+
+    def get_flag_path(self, flag_type: str, dataset_id: str) -> Path:
+        directory = self.flag_dir if flag_type == "soft" else self.hard_flag_dir
+        return Path(directory) / dataset_id
+
+    def is_erddap_ready(self) -> bool:
+        if not self.status_url:
+            return True
+        try:
+            with urllib.request.urlopen(self.status_url, timeout=self.poll_interval):
+                return True
+        except (urllib.error.URLError, OSError) as e:
+            logger.debug("ERDDAP status {} not available: {}", self.status_url, e)
+            return False
+
+    def wait_for_batch(self, paths: list) -> bool:
+        """Wait until ERDDAP consumed the flags and status_url responds"""
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            pending = [path for path in paths if path.exists()]
+            if not pending and self.is_erddap_ready():
+                return True
+            logger.debug("Wait for ERDDAP to process {} flags", len(pending))
+            time.sleep(self.poll_interval)
+        logger.warning("ERDDAP didn't process the flags after {}s", self.timeout)
+        return False
+
+    def run(self, diff: dict, datasets: dict = None, force_hard: bool = False):
+        """Write the flags of each changed dataset batch by batch
+
+        Returns:
+            dict: datasetIDs flagged for each flag type
+        """
+        flags = {"soft": [], "hard": []}
+        batches = self.schedule(diff, datasets, force_hard=force_hard)
+        for index, batch in enumerate(batches):
+            if index and self.interval:
+                time.sleep(self.interval)
+            logger.info("Write flags batch {}/{}", index + 1, len(batches))
+            paths = []
+            for flag_type, dataset_id in batch:
+                logger.info("Generate {} flag for {}", flag_type, dataset_id)
+                logger.debug("Diff: {}", diff[dataset_id])
+                path = self.get_flag_path(flag_type, dataset_id)
+                path.write_text("")
+                paths.append(path)
+                flags[flag_type].append(dataset_id)
+            if self.wait and index < len(batches) - 1:
+                self.wait_for_batch(paths)
+        return flags
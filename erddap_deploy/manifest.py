@@ -0,0 +1,127 @@
+import json
+from pathlib import Path
+from typing import Union
+
+from loguru import logger
+
+from erddap_deploy.erddap import Erddap, hash_file, write_atomic
+
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(datasets_xml: Union[str, Path]) -> Path:
+    """Path of the manifest saved next to a datasets.xml"""
+    datasets_xml = Path(datasets_xml)
+    return datasets_xml.with_name(f"{datasets_xml.name}.manifest.json")
+
+
+def save_manifest(
+    erddap: Erddap,
+    datasets_xml: Union[str, Path],
+    commit: str = None,
+    previous: dict = None,
+    sources: set = None,
+):
+    """Save the manifest of the datasets saved in datasets_xml
+
+    The manifest maps each datasetID to its canonical digest and the resolved
+    path of the file it was loaded from, along with the hash of datasets_xml to
+    detect if it was modified since and the commit of the datasets repository it
+    was saved from.
+
+    If erddap only loaded the datasets of the given sources files, the datasets
+    of the other files are kept from the previous manifest.
+    """
+    manifest_path = get_manifest_path(datasets_xml)
+    datasets = {}
+    if previous:
+        datasets = {
+            dataset_id: dataset
+            for dataset_id, dataset in previous["datasets"].items()
+            if not is_from_sources(dataset, sources or set())
+        }
+    datasets.update(
+        {
+            dataset_id: dict(
+                digest=dataset.digest,
+                structure_digest=dataset.structure_digest,
+                source=str(Path(dataset.source).resolve()) if dataset.source else None,
+            )
+            for dataset_id, dataset in erddap.datasets.items()
+        }
+    )
+    manifest = dict(
+        version=MANIFEST_VERSION,
+        datasets_xml_sha256=hash_file(datasets_xml),
+        commit=commit,
+        datasets=datasets,
+    )
+    logger.debug("Save manifest {}", manifest_path)
+    write_atomic(manifest_path, [json.dumps(manifest, indent=2)])
+    return manifest
+
+
+def load_manifest(datasets_xml: Union[str, Path]):
+    """Load the manifest of datasets_xml if it exists and is up to date"""
+    manifest_path = get_manifest_path(datasets_xml)
+    if not Path(datasets_xml).exists() or not manifest_path.exists():
+        logger.debug("No manifest available for {}", datasets_xml)
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="UTF-8"))
+    except ValueError as e:
+        logger.warning("Failed to read manifest {}: {}", manifest_path, e)
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.info("Ignore manifest {} from another version", manifest_path)
+        return None
+    if manifest.get("datasets_xml_sha256") != hash_file(datasets_xml):
+        logger.info("Ignore stale manifest {}", manifest_path)
+        return None
+    return manifest
+
+
+def is_from_sources(dataset: dict, sources: set) -> bool:
+    """Check if a manifest dataset was loaded from one of the sources resolved paths"""
+    return bool(dataset.get("source")) and Path(dataset["source"]).resolve() in sources
+
+
+def diff_manifest(erddap: Erddap, manifest: dict, sources: set = None) -> dict:
+    """Compare an Erddap object against a manifest and return the datasets that are different
+
+    Only the digests are available for the manifest datasets, modified datasets
+    are reported as a single changed "addAttributes" change if their structure
+    digest is unchanged, "dataset" change otherwise. If erddap only loaded the
+    datasets of the given sources files, it is only compared against the
+    manifest datasets of those files.
+    """
+    datasets = manifest["datasets"]
+    if sources is not None:
+        datasets = {
+            dataset_id: dataset
+            for dataset_id, dataset in datasets.items()
+            if is_from_sources(dataset, sources) or dataset_id in erddap.datasets
+        }
+    differences = {}
+    for dataset_id, dataset in erddap.datasets.items():
+        if dataset_id not in datasets:
+            differences[dataset_id] = [
+                dict(element="dataset", name=dataset_id, action="added")
+            ]
+        elif dataset.digest != datasets[dataset_id]["digest"]:
+            metadata_only = dataset.structure_digest == datasets[dataset_id].get(
+                "structure_digest"
+            )
+            differences[dataset_id] = [
+                dict(
+                    element="addAttributes" if metadata_only else "dataset",
+                    name=dataset_id,
+                    action="changed",
+                )
+            ]
+    for dataset_id in datasets:
+        if dataset_id not in erddap.datasets:
+            differences[dataset_id] = [
+                dict(element="dataset", name=dataset_id, action="removed")
+            ]
+    return differences
@@ -1,7 +1,16 @@
+import hashlib
 import json
+import math
 import os
+import random
 import re
 import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
 from typing import Union
 
@@ -11,6 +20,8 @@ from loguru import logger
 from tqdm import tqdm
 from uptime_kuma_api import UptimeKumaApi, exceptions
 
+from erddap_deploy.monitor_rules import MonitorRules
+
 load_dotenv()
 
 
@@ -23,6 +34,83 @@ def get_erddap_protocol(dataset):
         raise ValueError(f"Unknown dataset type {dataset.type}")
 
 
+def get_erddap_url(erddap_url: str = None) -> str:
+    """Default erddap_url to the ERDDAP_baseHttpsUrl or ERDDAP_baseUrl environment variables"""
+    if erddap_url is None:
+        logger.debug("Retrieve erddap_url from environment variables")
+        if os.environ.get("ERDDAP_baseHttpsUrl"):
+            erddap_url = os.environ.get("ERDDAP_baseHttpsUrl") + "/erddap"
+            logger.debug("Using erddap_url=ERDDAP_baseHttpsUrl={}", erddap_url)
+        elif os.environ.get("ERDDAP_baseUrl"):
+            erddap_url = os.environ.get("ERDDAP_baseUrl") + "/erddap"
+            logger.debug("Using erddap_url=ERDDAP_baseUrl={}", erddap_url)
+        else:
+            logger.error("ERDDAP_baseUrl or ERDDAP_baseHttpsUrl is required")
+            sys.exit(1)
+    else:
+        logger.debug("Using erddap_url={}", erddap_url)
+    return erddap_url
+
+
+def get_monitor_dataset_id(monitor: dict) -> str:
+    """Retrieve the datasetID monitored by an ERDDAP dataset monitor, None for other monitors"""
+    match = re.match(r"(?:tabledap|griddap)/([^/?]+?)\.html", monitor.get("name") or "")
+    return match and match.group(1)
+
+
+def load_monitor_state(state_file: Union[str, Path]) -> dict:
+    state_file = Path(state_file)
+    if not state_file.exists():
+        return {}
+    try:
+        return json.loads(state_file.read_text())
+    except ValueError as e:
+        logger.warning("Failed to read monitor state {}: {}", state_file, e)
+        return {}
+
+
+def save_monitor_state(state_file: Union[str, Path], state: dict) -> bool:
+    state_file = Path(state_file)
+    try:
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        state_file.write_text(json.dumps(state, indent=2))
+    except OSError as e:
+        logger.warning("Failed to save monitor state {}: {}", state_file, e)
+        return False
+    return True
+
+
+def get_changed_datasets(datasets: list, state: dict) -> set:
+    """Get the datasetIDs added, removed or changed since the digests recorded in state
+
+    Return None if no digests were recorded.
+    """
+    digests = state.get("datasets")
+    if digests is None:
+        return None
+    current = {dataset.dataset_id: dataset.digest for dataset in datasets}
+    return {
+        dataset_id
+        for dataset_id in current.keys() | digests.keys()
+        if current.get(dataset_id) != digests.get(dataset_id)
+    }
+
+
+def is_full_reconcile_due(state_file: Union[str, Path], interval: float) -> bool:
+    """Check if the last full reconciliation is older than interval hours"""
+    last_full_reconcile = load_monitor_state(state_file).get("last_full_reconcile")
+    return not last_full_reconcile or (
+        time.time() - last_full_reconcile > interval * 3600
+    )
+
+
+def get_requests_per_minute(monitors: list) -> float:
+    """Expected number of requests per minute made by monitors"""
+    return sum(
+        60 / monitor["interval"] for monitor in monitors if monitor.get("interval")
+    )
+
+
 def dry_run(func):
     """Decorator to log the action that would be taken if dry_run is not enabled"""
 
@@ -37,19 +125,285 @@ def dry_run(func):
     return wrapper
 
 
-def retry_timeout(func, retries=3):
-    """Decorator to retry a function"""
+class RetryPolicy:
+    """Retry failed calls with an exponential backoff and jitter
+
+    A call is attempted up to max_attempts times as long as it raises one of the
+    retry_on exceptions, waiting backoff * 2**attempt seconds (capped at
+    max_backoff and randomized by jitter) between attempts. No retry is
+    started past the deadline in seconds since the policy creation.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        jitter: float = 0.5,
+        retry_on: tuple = (exceptions.Timeout, TimeoutError, ConnectionError),
+        deadline: float = None,
+    ):
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def get_delay(self, attempt: int) -> float:
+        delay = min(self.backoff * 2**attempt, self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def _record(self, name: str, latency: float, retries: int, failed: bool):
+        with self.lock:
+            stats = self.stats.setdefault(
+                name, dict(calls=0, retries=0, failures=0, latency=0.0, max_latency=0.0)
+            )
+            stats["calls"] += 1
+            stats["retries"] += retries
+            stats["failures"] += failed
+            stats["latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
 
-    def wrapper(*args, **kwargs):
-        for i in range(retries):
+    def call(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) and retry it following the policy"""
+        name = getattr(func, "__name__", repr(func))
+        start = time.monotonic()
+        attempt = 0
+        while True:
             try:
-                return func(*args, **kwargs)
-            except exceptions.TimeoutError as e:
-                logger.error("Error: {} retrying...", e)
-                continue
-        raise Exception(f"Failed to run {func.__name__} after 3 retries")
+                result = func(*args, **kwargs)
+                self._record(name, time.monotonic() - start, attempt, False)
+                return result
+            except self.retry_on as e:
+                delay = self.get_delay(attempt)
+                attempt += 1
+                if attempt >= self.max_attempts or (
+                    self.deadline and time.monotonic() + delay > self.deadline
+                ):
+                    self._record(name, time.monotonic() - start, attempt - 1, True)
+                    raise
+                logger.warning(
+                    "{} failed: {!r}, retry {}/{} in {:.1f}s",
+                    name,
+                    e,
+                    attempt,
+                    self.max_attempts - 1,
+                    delay,
+                )
+                time.sleep(delay)
+            except Exception:
+                self._record(name, time.monotonic() - start, attempt, True)
+                raise
+
+    def report(self) -> str:
+        """Summary of the calls made, their retries and latency"""
+        with self.lock:
+            return ", ".join(
+                f"{name}(calls={stats['calls']}, retries={stats['retries']}, "
+                f"failures={stats['failures']}, "
+                f"mean={stats['latency'] / stats['calls']:.3f}s, "
+                f"max={stats['max_latency']:.3f}s)"
+                for name, stats in sorted(self.stats.items())
+            )
+
+
+class RetryingApi:
+    """Proxy to an UptimeKumaApi where every method call follows a RetryPolicy
+
+    add_monitor isn't idempotent: before retrying it, the monitors are fetched
+    to check if the failed attempt created the monitor anyway (ex: response
+    timed out), in which case the existing monitor is returned.
+    """
+
+    def __init__(self, api: UptimeKumaApi, retry_policy: RetryPolicy = None):
+        self.api = api
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def add_monitor(self, **kwargs):
+        attempts = 0
+
+        def add_monitor(**kwargs):
+            nonlocal attempts
+            if attempts:
+                monitor = self.find_monitor(kwargs["name"], kwargs.get("parent"))
+                if monitor is not None:
+                    logger.info(
+                        "Monitor {} was added by a failed attempt", kwargs["name"]
+                    )
+                    return {"msg": "Added Successfully.", "monitorID": monitor["id"]}
+            attempts += 1
+            return self.api.add_monitor(**kwargs)
+
+        return self.retry_policy.call(add_monitor, **kwargs)
+
+    def find_monitor(self, name: str, parent: int = None) -> dict:
+        return next(
+            (
+                monitor
+                for monitor in self.api.get_monitors()
+                if monitor["name"] == name and monitor.get("parent") == parent
+            ),
+            None,
+        )
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            return self.retry_policy.call(attr, *args, **kwargs)
+
+        wrapper.__name__ = name
+        return wrapper
 
-    return wrapper
+
+class RateLimiter:
+    """Space out operations shared between threads to at most rate operations per second"""
+
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_operations(
+    operations: list,
+    parallelism: int = 1,
+    rate_limit: float = None,
+    desc: str = "Update monitors",
+) -> list:
+    """Run operations concurrently and return the result of each one
+
+    Args:
+        operations (list): List of (name, function) to run
+        parallelism (int): Number of operations running at once
+        rate_limit (float): Maximum number of operations started per second
+        desc (str): Progress bar description
+
+    Returns:
+        list: dict(name, result, error) for each operation, in the same order
+    """
+    rate_limiter = RateLimiter(rate_limit)
+
+    def run(operation):
+        name, func = operation
+        rate_limiter.wait()
+        try:
+            return dict(name=name, result=func(), error=None)
+        except Exception as error:
+            logger.error("Failed to {}: {}", name, error)
+            return dict(name=name, result=None, error=error)
+
+    if not operations:
+        return []
+    with ThreadPoolExecutor(max(parallelism, 1)) as executor:
+        return list(
+            tqdm(
+                executor.map(run, operations),
+                desc=desc,
+                unit="monitor",
+                total=len(operations),
+            )
+        )
+
+
+class MonitorInventory:
+    """Monitors available on the uptime kuma instance, fetched once and indexed by id and pathName
+
+    The inventory is updated locally when monitors are added, paused or resumed
+    and is only fetched again from uptime kuma when refresh() is called. Without
+    api, the inventory is empty (ex: to only generate the expected monitors).
+    """
+
+    def __init__(self, api: UptimeKumaApi):
+        self.api = api
+        self.monitors = {}
+        self.path_names = {}
+        self.refresh()
+
+    def __len__(self):
+        return len(self.monitors)
+
+    def __iter__(self):
+        return iter(list(self.monitors.values()))
+
+    def refresh(self):
+        """Fetch every monitor from uptime kuma"""
+        logger.debug("Fetch uptime kuma monitors")
+        self.monitors = {}
+        self.path_names = {}
+        if self.api is None:
+            return
+        for monitor in self.api.get_monitors():
+            self.add(monitor)
+
+    def add(self, monitor: dict):
+        self.monitors[monitor["id"]] = monitor
+        self.path_names[monitor["pathName"]] = monitor
+
+    def update(self, id: int, **kwargs):
+        self.monitors[id].update(kwargs)
+
+    def remove(self, id: int):
+        monitor = self.monitors.pop(id)
+        self.path_names.pop(monitor["pathName"], None)
+
+    def get(self, id: int) -> dict:
+        return self.monitors.get(id)
+
+    def get_by_path_name(self, path_name: str) -> dict:
+        return self.path_names.get(path_name)
+
+
+class MonitorPlan:
+    """Changes needed to reconcile the uptime kuma monitors with the expected ones"""
+
+    def __init__(self):
+        self.add = []
+        self.pause = []
+        self.resume = []
+        self.update = []
+        self.orphan = []
+        self.requests_per_minute = None
+
+    def __len__(self):
+        return len(self.add) + len(self.pause) + len(self.resume) + len(self.update)
+
+    def report(self) -> str:
+        """Human readable summary of the plan"""
+        lines = [
+            f"{len(self.add)} to add, {len(self.pause)} to pause, "
+            f"{len(self.resume)} to resume, {len(self.update)} to update, "
+            f"{len(self.orphan)} orphaned"
+            + (
+                f", {self.requests_per_minute:.1f} requests/min expected"
+                if self.requests_per_minute is not None
+                else ""
+            )
+        ]
+        lines += [f"  + add {monitor['pathName']}" for monitor in self.add]
+        lines += [f"  - pause {monitor['pathName']}" for monitor in self.pause]
+        lines += [f"  > resume {monitor['pathName']}" for monitor in self.resume]
+        lines += [
+            f"  ~ update {monitor['pathName']}: {changes}"
+            for monitor, changes in self.update
+        ]
+        lines += [f"  ? orphan {monitor['pathName']}" for monitor in self.orphan]
+        return "\n".join(lines)
 
 
 class ErddapMonitor:
@@ -65,6 +419,12 @@ class ErddapMonitor:
         monitors: list = [],
         dry_run: bool = False,
         monitor_kwargs: dict = None,
+        parallelism: int = 1,
+        rate_limit: float = None,
+        max_group_size: int = None,
+        rules: MonitorRules = None,
+        max_requests_per_minute: float = None,
+        interval_spread: float = 0,
     ):
         self.api = api
         self.erddap_name = erddap_name or re.search(r"https?://(.*)", erddap_url).group(
@@ -77,10 +437,18 @@ class ErddapMonitor:
             "slug": self.status_page_slug,
         }
         self.datasets = datasets
+        self.inventory = MonitorInventory(api)
         self.parent = parent or self.get_parent()
         self.monitors = monitors or self.get_monitors()
         self.dry_run = dry_run
         self.monitor_kwargs = monitor_kwargs
+        self.parallelism = parallelism
+        self.rate_limit = rate_limit
+        self.max_group_size = max_group_size
+        self.rules = rules or MonitorRules()
+        self.max_requests_per_minute = max_requests_per_minute
+        self.interval_spread = interval_spread
+        self.requests_per_minute = None
 
     def _get_slug_from_erddap_name(self) -> str:
         # replace all non alphanumeric characters with a dash
@@ -156,29 +524,47 @@ class ErddapMonitor:
         """Get all monitors for the ERDDAP instance running on uptime kuma"""
         return [
             monitor
-            for monitor in self.api.get_monitors()
+            for monitor in self.inventory
             if monitor["pathName"].startswith(f"{self.erddap_name} / ")
         ]
 
     def get_parent(self):
-        for parent in self.api.get_monitors():
-            if parent["pathName"] == self.erddap_name:
-                return parent
+        return self.inventory.get_by_path_name(self.erddap_name)
 
     @dry_run
     def add_monitor(self, *args, **kwargs):
         logger.info("Add monitor {}", kwargs.get("name"))
-        return self.api.add_monitor(*args, **(self.monitor_kwargs or {}), **kwargs)
+        response = self.api.add_monitor(*args, **(self.monitor_kwargs or {}), **kwargs)
+        self.inventory.add(
+            dict(
+                **kwargs,
+                id=response["monitorID"],
+                pathName=f"{self.parent['pathName']} / {kwargs['name']}",
+                active=True,
+            )
+        )
+        return response
 
     @dry_run
     def pause_monitor(self, *args, **kwargs):
         logger.info("Pause monitor {}", kwargs.get("name"))
-        return self.api.pause_monitor(kwargs["id"])
+        response = self.api.pause_monitor(kwargs["id"])
+        self.inventory.update(kwargs["id"], active=False)
+        return response
+
+    @dry_run
+    def edit_monitor(self, *args, changes: dict = None, **kwargs):
+        logger.info("Update monitor {}: {}", kwargs.get("name"), changes)
+        response = self.api.edit_monitor(kwargs["id"], **changes)
+        self.inventory.update(kwargs["id"], **changes)
+        return response
 
     @dry_run
     def resume_monitor(self, *args, **kwargs):
         logger.info("Resume monitor {}", kwargs.get("name"))
-        return self.api.resume_monitor(kwargs["id"])
+        response = self.api.resume_monitor(kwargs["id"])
+        self.inventory.update(kwargs["id"], active=True)
+        return response
 
     def add_parent(self):
         logger.info(f"Adding parent {self.erddap_name}")
@@ -190,73 +576,203 @@ class ErddapMonitor:
         if "Added Successfully" not in response["msg"]:
             raise Exception(f"Failed to add parent: {response['msg']}")
         self.parent = self.api.get_monitor(response["monitorID"])
+        self.inventory.add(self.parent)
 
-    def generate_monitors(self):
-        """Generate expected monitors for the ERDDAP instance based on the dataset.xml file"""
-        monitors = self.make_erddap_pages_monitor()
+    def generate_monitors(self, dataset_ids: set = None):
+        """Generate expected monitors for the ERDDAP instance based on the dataset.xml file
+
+        The monitors of each dataset and their settings are defined by the
+        monitor rules, and their intervals adjusted to the load budget. If
+        dataset_ids is given, only the ERDDAP pages monitors and the monitors
+        of those datasets are generated.
+        """
+        pages_monitors = self.make_erddap_pages_monitor(**self.rules.pages)
+        datasets_monitors = []
         for dataset in self.datasets:
-            # TODO add manual overrides from .upttimekuma.yml
-            monitors.append(self.make_dataset_page_monitor(dataset))
-            if any(
-                term in dataset.dataset_id.lower()
-                for term in ("realtime", "Real-Time", "5min")
-            ):
-                monitors.append(self.make_realtime_dataset_monitor(dataset))
-        return monitors
-
-    def get_missing_monitors(self, monitors: list):
-        monitor_pathnames = [monitor["pathName"] for monitor in self.get_monitors()]
-        return [
+            settings = self.rules.get_monitors(dataset)
+            if "page" in settings:
+                datasets_monitors.append(
+                    self.make_dataset_page_monitor(dataset, **settings["page"])
+                )
+            if "data" in settings:
+                datasets_monitors.append(
+                    self.make_dataset_data_monitor(dataset, **settings["data"])
+                )
+            if "realtime" in settings:
+                datasets_monitors.append(
+                    self.make_realtime_dataset_monitor(dataset, **settings["realtime"])
+                )
+
+        # intervals depend on every dataset monitors, even when only some are generated
+        self.apply_load_budget(pages_monitors, datasets_monitors)
+        return pages_monitors + [
             monitor
-            for monitor in monitors
-            if monitor["pathName"] not in monitor_pathnames
+            for monitor in datasets_monitors
+            if dataset_ids is None or get_monitor_dataset_id(monitor) in dataset_ids
         ]
 
-    def add_monitors(self, monitors: list):
-        for monitor in monitors:
-            response = self.add_monitor(
-                parent=self.parent["id"],
-                **{
-                    key: value
-                    for key, value in monitor.items()
-                    if key not in ("pathName", "active")
-                },
+    def apply_load_budget(self, pages_monitors: list, datasets_monitors: list):
+        """Scale and stagger the dataset monitors intervals
+
+        Intervals are scaled up to keep the requests made to ERDDAP within
+        max_requests_per_minute. The scale is rounded up to a power of 2 so that
+        the intervals, and the existing monitors, only change when the catalog
+        size crosses a step. Each interval is extended by up to
+        interval_spread of itself, based on a hash of the monitor name, to
+        avoid checking every dataset at the same time.
+        """
+        scale = 1
+        if self.max_requests_per_minute:
+            available = self.max_requests_per_minute - get_requests_per_minute(
+                pages_monitors
             )
-            if not self.dry_run:
-                logger.info("{} monitorID={}", response["msg"], response["monitorID"])
+            datasets_requests_per_minute = get_requests_per_minute(datasets_monitors)
+            if available <= 0:
+                logger.warning(
+                    "ERDDAP pages monitors alone exceed {} requests/min",
+                    self.max_requests_per_minute,
+                )
+            elif datasets_requests_per_minute > available:
+                scale = 2 ** math.ceil(
+                    math.log2(datasets_requests_per_minute / available)
+                )
+                logger.info(
+                    "Scale dataset monitors intervals by {:.2f} to stay within {} requests/min",
+                    scale,
+                    self.max_requests_per_minute,
+                )
+        for monitor in datasets_monitors:
+            interval = monitor["interval"] * scale
+            if self.interval_spread:
+                bucket = zlib.crc32(monitor["name"].encode()) % 1000 / 1000
+                interval *= 1 + self.interval_spread * bucket
+            monitor["interval"] = math.ceil(interval)
+        self.requests_per_minute = get_requests_per_minute(
+            pages_monitors + datasets_monitors
+        )
 
-    def pause_monitors(self, expected_monitors: dict):
-        for monitor in self.get_monitors():
-            expected_monitor = [
-                item
-                for item in expected_monitors
-                if item["pathName"] == monitor["pathName"]
-            ]
-            if not expected_monitor:
-                continue
-            if monitor["active"] and not expected_monitor[0]["active"]:
-                self.pause_monitor(**monitor)
+    def plan_monitors(
+        self, expected_monitors: list, dataset_ids: set = None
+    ) -> MonitorPlan:
+        """Compare the expected monitors with the existing ones in a single pass
 
-    def resume_monitors(self, expected_monitors: dict):
-        for monitor in self.get_monitors():
-            expected_monitor = [
-                item
-                for item in expected_monitors
-                if item["pathName"] == monitor["pathName"]
-            ]
-            if not expected_monitor:
+        Existing monitors are added, paused, resumed or updated (interval or url
+        drift) to match the expected ones. Existing ERDDAP monitors that aren't
+        expected are listed as orphans, only the ones of dataset_ids if given.
+        """
+        existing_monitors = {
+            monitor["pathName"]: monitor for monitor in self.get_monitors()
+        }
+        plan = MonitorPlan()
+        plan.requests_per_minute = self.requests_per_minute
+        for expected_monitor in expected_monitors:
+            monitor = existing_monitors.pop(expected_monitor["pathName"], None)
+            if monitor is None:
+                plan.add.append(expected_monitor)
                 continue
-            if not monitor["active"] and expected_monitor[0]["active"]:
-                self.resume_monitor(**monitor)
+            if monitor["active"] and not expected_monitor["active"]:
+                plan.pause.append(monitor)
+            elif not monitor["active"] and expected_monitor["active"]:
+                plan.resume.append(monitor)
+            changes = {
+                key: expected_monitor[key]
+                for key in ("interval", "url")
+                if key in expected_monitor and monitor.get(key) != expected_monitor[key]
+            }
+            if changes:
+                plan.update.append((monitor, changes))
+        plan.orphan = [
+            monitor
+            for monitor in existing_monitors.values()
+            if dataset_ids is None or get_monitor_dataset_id(monitor) in dataset_ids
+        ]
+        return plan
+
+    def execute_plan(self, plan: MonitorPlan) -> list:
+        """Apply the plan changes to uptime kuma, orphaned monitors are left untouched
+
+        Operations run concurrently following the parallelism and rate_limit
+        settings. Return the result of each operation.
+        """
+        operations = [
+            (f"add {monitor['pathName']}", partial(self._add_child_monitor, monitor))
+            for monitor in plan.add
+        ]
+        operations += [
+            (f"pause {monitor['pathName']}", partial(self.pause_monitor, **monitor))
+            for monitor in plan.pause
+        ]
+        operations += [
+            (f"resume {monitor['pathName']}", partial(self.resume_monitor, **monitor))
+            for monitor in plan.resume
+        ]
+        operations += [
+            (
+                f"update {monitor['pathName']}",
+                partial(self.edit_monitor, **monitor, changes=changes),
+            )
+            for monitor, changes in plan.update
+        ]
+        return self.run_operations(operations)
+
+    def run_operations(self, operations: list, desc: str = "Update monitors"):
+        return run_operations(
+            operations,
+            parallelism=self.parallelism,
+            rate_limit=self.rate_limit,
+            desc=desc,
+        )
+
+    def _add_child_monitor(self, monitor: dict):
+        """Add a monitor to the ERDDAP group, paused if its dataset is inactive"""
+        response = self.add_monitor(
+            parent=self.parent["id"],
+            **{
+                key: value
+                for key, value in monitor.items()
+                if key not in ("pathName", "active")
+            },
+        )
+        if self.dry_run:
+            return response
+        logger.info("{} monitorID={}", response["msg"], response["monitorID"])
+        if monitor.get("active") in (False, "false"):
+            self.pause_monitor(id=response["monitorID"], name=monitor["name"])
+        return response
 
     def get_status_page(self):
         for status_page in self.api.get_status_pages():
             if status_page["slug"] == self.status_page_slug:
                 return status_page
 
-    def save_status_page(self, **kwargs):
+    def _make_group(self, name: str, monitors: list) -> list:
+        """Make a status page group, split in numbered groups of max_group_size monitors"""
+        monitor_list = [{"id": monitor["id"]} for monitor in monitors]
+        size = self.max_group_size
+        if not size or len(monitor_list) <= size:
+            return [{"name": name, "weight": 1, "monitorList": monitor_list}]
+        n_groups = -(-len(monitor_list) // size)
+        return [
+            {
+                "name": f"{name} ({index + 1}/{n_groups})",
+                "weight": 1,
+                "monitorList": monitor_list[index * size : (index + 1) * size],
+            }
+            for index in range(n_groups)
+        ]
+
+    def make_status_page(self, **kwargs) -> dict:
+        """Generate the status page payload from the monitors inventory in a single pass"""
+        groups = {"pages": [], "datasets": [], "realtime": []}
+        for monitor in self.get_monitors():
+            if "index.html" in monitor["pathName"]:
+                groups["pages"].append(monitor)
+            elif "now-" in monitor["pathName"]:
+                groups["realtime"].append(monitor)
+            else:
+                groups["datasets"].append(monitor)
         status_page = dict(
-            title="ERDDAP Status: {erddap_name}",
+            title=f"ERDDAP Status: {self.erddap_name}",
             description=(
                 f"ERDDAP Status Page for  {self.erddap_name} available at "
                 f'<a href="{self.erddap_url}">{self.erddap_url}</a>'
@@ -265,53 +781,59 @@ class ErddapMonitor:
             domainNameList=[self.erddap_url],
             footerText=f"<a href={self.erddap_url}>{self.erddap_name}</a>",
             publicGroupList=[
-                {
-                    "name": "ERDDAP Pages",
-                    "weight": 1,
-                    "monitorList": [
-                        {"id": monitor["id"]}
-                        for monitor in self.get_monitors()
-                        if "index.html" in monitor["pathName"]
-                    ],
-                },
-                {
-                    "name": "ERDDAP Datasets",
-                    "weight": 1,
-                    "monitorList": [
-                        {"id": monitor["id"]}
-                        for monitor in self.get_monitors()
-                        if (
-                            "index.html" not in monitor["pathName"]
-                            and "now-" not in monitor["pathName"]
-                        )
-                    ],
-                },
-                {
-                    "name": "ERDDAP Realtime Datasets",
-                    "weight": 1,
-                    "monitorList": [
-                        {"id": monitor["id"]}
-                        for monitor in self.get_monitors()
-                        if "now-" in monitor["pathName"]
-                    ],
-                },
+                *self._make_group("ERDDAP Pages", groups["pages"]),
+                *self._make_group("ERDDAP Datasets", groups["datasets"]),
+                *self._make_group("ERDDAP Realtime Datasets", groups["realtime"]),
             ],
         )
         if kwargs:
             kwargs.pop("slug", None)
             status_page.update(kwargs)
-        return self.api.save_status_page(slug=self.status_page_slug, **status_page)
+        return status_page
 
-    def get_deleted_monitors(self):
-        pass
+    @staticmethod
+    def get_status_page_digest(status_page: dict, keys=None) -> str:
+        """Hash the status page settings and its groups monitor ids
 
+        Only the given keys are considered to compare a generated payload with
+        the status page returned by uptime kuma, which includes extra fields.
+        """
+        content = {
+            key: status_page.get(key) for key in keys or status_page if key != "slug"
+        }
+        content["publicGroupList"] = [
+            [
+                group["name"],
+                [monitor["id"] for monitor in group.get("monitorList", [])],
+            ]
+            for group in status_page.get("publicGroupList") or []
+        ]
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def save_status_page(self, **kwargs):
+        """Save the status page if it differs from the one on uptime kuma"""
+        status_page = self.make_status_page(**kwargs)
+        try:
+            current_status_page = self.api.get_status_page(self.status_page_slug)
+        except exceptions.UptimeKumaException as e:
+            logger.debug("Failed to get status page {}: {}", self.status_page_slug, e)
+            current_status_page = None
+        if current_status_page and self.get_status_page_digest(
+            current_status_page, status_page.keys()
+        ) == self.get_status_page_digest(status_page):
+            logger.info("Status page {} is up to date", self.status_page_slug)
+            return None
+        return self.api.save_status_page(slug=self.status_page_slug, **status_page)
 
-def uptime_delete_monitors(api, delete_monitors, dry_run=False):
-    @logger.catch()
-    @retry_timeout
+
+def uptime_delete_monitors(
+    api, delete_monitors, dry_run=False, parallelism=1, rate_limit=None
+):
     def _delete_monitor(monitor):
         logger.info("Deleting monitor {}", monitor["pathName"])
-        api.delete_monitor(monitor["id"])
+        return api.delete_monitor(monitor["id"])
 
     monitors_to_delete = [
         monitor
@@ -323,13 +845,15 @@ def uptime_delete_monitors(api, delete_monitors, dry_run=False):
         for monitor in monitors_to_delete:
             logger.info("Would delete monitor {}", monitor["pathName"])
         return
-    for monitor in tqdm(
-        monitors_to_delete,
+    return run_operations(
+        [
+            (f"delete {monitor['pathName']}", partial(_delete_monitor, monitor))
+            for monitor in monitors_to_delete
+        ],
+        parallelism=parallelism,
+        rate_limit=rate_limit,
         desc="Deleting monitors",
-        unit="monitor",
-        total=len(monitors_to_delete),
-    ):
-        _delete_monitor(monitor)
+    )
 
 
 @logger.catch(reraise=True)
@@ -347,68 +871,173 @@ def uptime_kuma_monitor(
     dry_run: bool = False,
     monitor_kwargs: dict = None,
     timeout: float = 10.0,
+    parallelism: int = 1,
+    rate_limit: float = None,
+    retry_policy: RetryPolicy = None,
+    api: UptimeKumaApi = None,
+    changed_datasets: set = None,
+    state_file: Union[str, Path] = None,
+    full_reconcile_interval: float = None,
+    max_group_size: int = None,
+    monitor_rules: MonitorRules = None,
+    max_requests_per_minute: float = None,
+    interval_spread: float = 0,
 ):
-    # Connect to the uptime kuma instance
-    with UptimeKumaApi(uptime_kuma_url, timeout=timeout) as api:
-        api.login(username=username, password=password, token=token)
+    """Reconcile the uptime kuma monitors and status page with the ERDDAP datasets
 
-        if delete_monitors:
-            uptime_delete_monitors(api, delete_monitors, dry_run=dry_run)
-            return
+    An already connected api (ex: FakeUptimeKumaApi) can be given instead of
+    connecting to uptime_kuma_url.
 
-        erddap_monitor = ErddapMonitor(
-            api=api,
-            erddap_name=erddap_name,
-            erddap_url=erddap_url,
-            status_page_slug=status_page_slug,
-            status_page=status_page,
-            datasets=datasets,
+    If changed_datasets is given, only the monitors of those datasets and the
+    ERDDAP pages monitors are reconciled, unless the last full reconciliation
+    recorded in state_file is older than full_reconcile_interval hours. After
+    a successful run, state_file also records the digest of each dataset (see
+    get_changed_datasets).
+    """
+    with ExitStack() as stack:
+        if api is None:
+            # Connect to the uptime kuma instance
+            api = stack.enter_context(UptimeKumaApi(uptime_kuma_url, timeout=timeout))
+            api.login(username=username, password=password, token=token)
+        api = RetryingApi(api, retry_policy)
+        try:
+            _uptime_kuma_monitor(
+                api,
+                erddap_name=erddap_name,
+                erddap_url=erddap_url,
+                status_page_slug=status_page_slug,
+                status_page=status_page,
+                datasets=datasets,
+                delete_monitors=delete_monitors,
+                dry_run=dry_run,
+                monitor_kwargs=monitor_kwargs,
+                parallelism=parallelism,
+                rate_limit=rate_limit,
+                changed_datasets=changed_datasets,
+                state_file=state_file,
+                full_reconcile_interval=full_reconcile_interval,
+                max_group_size=max_group_size,
+                monitor_rules=monitor_rules,
+                max_requests_per_minute=max_requests_per_minute,
+                interval_spread=interval_spread,
+            )
+        finally:
+            logger.info("Uptime kuma API calls: {}", api.retry_policy.report())
+
+
+def _uptime_kuma_monitor(
+    api,
+    erddap_name: str = None,
+    erddap_url: str = None,
+    status_page_slug: str = None,
+    status_page: Path = None,
+    datasets: str = "**/datasets.xml",
+    delete_monitors: str = None,
+    dry_run: bool = False,
+    monitor_kwargs: dict = None,
+    parallelism: int = 1,
+    rate_limit: float = None,
+    changed_datasets: set = None,
+    state_file: Union[str, Path] = None,
+    full_reconcile_interval: float = None,
+    max_group_size: int = None,
+    monitor_rules: MonitorRules = None,
+    max_requests_per_minute: float = None,
+    interval_spread: float = 0,
+):
+    if delete_monitors:
+        uptime_delete_monitors(
+            api,
+            delete_monitors,
             dry_run=dry_run,
-            monitor_kwargs=monitor_kwargs,
+            parallelism=parallelism,
+            rate_limit=rate_limit,
         )
+        return
 
-        logger.info(f"Found {len(erddap_monitor.monitors)} erddap dataset monitors")
-        if not erddap_monitor.datasets:
-            return
-        logger.info(f"Found {len(erddap_monitor.datasets)} datasets")
+    erddap_monitor = ErddapMonitor(
+        api=api,
+        erddap_name=erddap_name,
+        erddap_url=erddap_url,
+        status_page_slug=status_page_slug,
+        status_page=status_page,
+        datasets=datasets,
+        dry_run=dry_run,
+        monitor_kwargs=monitor_kwargs,
+        parallelism=parallelism,
+        rate_limit=rate_limit,
+        max_group_size=max_group_size,
+        rules=monitor_rules,
+        max_requests_per_minute=max_requests_per_minute,
+        interval_spread=interval_spread,
+    )
 
-        # Generate expected erddap monitors
-        expected_monitors = erddap_monitor.generate_monitors()
+    logger.info(f"Found {len(erddap_monitor.monitors)} erddap dataset monitors")
+    if not erddap_monitor.datasets:
+        return
+    logger.info(f"Found {len(erddap_monitor.datasets)} datasets")
+
+    if (
+        changed_datasets is not None
+        and state_file
+        and full_reconcile_interval is not None
+        and is_full_reconcile_due(state_file, full_reconcile_interval)
+    ):
+        logger.info("Full reconciliation is due, reconcile every dataset monitors")
+        changed_datasets = None
+    if changed_datasets is not None:
+        logger.info(
+            "Reconcile monitors of {} changed datasets: {}",
+            len(changed_datasets),
+            sorted(changed_datasets),
+        )
 
-        # if parent doesn't exist, create it
-        if not erddap_monitor.parent:
-            erddap_monitor.add_parent()
+    # Generate expected erddap monitors
+    expected_monitors = erddap_monitor.generate_monitors(changed_datasets)
 
-        # Generate missing monitors
-        missing_monitors = erddap_monitor.get_missing_monitors(expected_monitors)
-        logger.info("{} monitors are missing", len(missing_monitors))
-        erddap_monitor.add_monitors(missing_monitors)
+    # if parent doesn't exist, create it
+    if not erddap_monitor.parent:
+        erddap_monitor.add_parent()
 
-        # Pause/Resume active datasets monitors
-        erddap_monitor.pause_monitors(expected_monitors)
-        erddap_monitor.resume_monitors(expected_monitors)
+    # Add missing monitors, pause/resume and update existing ones
+    plan = erddap_monitor.plan_monitors(expected_monitors, changed_datasets)
+    logger.info("Monitors plan: {}", plan.report())
+    results = erddap_monitor.execute_plan(plan)
+    failed = [result["name"] for result in results if result["error"]]
+    if failed:
+        logger.error("{} monitor operations failed: {}", len(failed), failed)
+    elif state_file and not dry_run:
+        state = load_monitor_state(state_file)
+        if changed_datasets is None:
+            state["last_full_reconcile"] = time.time()
+        state["datasets"] = {
+            dataset.dataset_id: dataset.digest for dataset in erddap_monitor.datasets
+        }
+        save_monitor_state(state_file, state)
 
-        # Maintain status pag
-        status_page = erddap_monitor.get_status_page()
-        if not status_page:
-            logger.info(
-                "Adding status page {} with title {}",
-                erddap_monitor.status_page_slug,
-                f"ERDDAP Status: {erddap_monitor.erddap_name}",
-            )
-            erddap_monitor.api.add_status_page(
-                erddap_monitor.status_page_slug,
-                f"ERDDAP Status: {erddap_monitor.erddap_name}",
-            )
-        logger.info("Updating status page {}", erddap_monitor.status_page_slug)
-        erddap_monitor.save_status_page(**erddap_monitor.status_page)
+    # Maintain status pag
+    status_page = erddap_monitor.get_status_page()
+    if not status_page:
+        logger.info(
+            "Adding status page {} with title {}",
+            erddap_monitor.status_page_slug,
+            f"ERDDAP Status: {erddap_monitor.erddap_name}",
+        )
+        erddap_monitor.api.add_status_page(
+            erddap_monitor.status_page_slug,
+            f"ERDDAP Status: {erddap_monitor.erddap_name}",
+        )
+    logger.info("Check status page {}", erddap_monitor.status_page_slug)
+    erddap_monitor.save_status_page(**erddap_monitor.status_page)
 
-        # Warn about deleted monitors
-        deleted_monitors = erddap_monitor.get_deleted_monitors()
-        if deleted_monitors:
-            logger.warning("The following monitors were deleted: {}", deleted_monitors)
+    # Warn about monitors not matching any dataset
+    if plan.orphan:
+        logger.warning(
+            "The following monitors don't match any dataset: {}",
+            [monitor["pathName"] for monitor in plan.orphan],
+        )
 
-        logger.info("Uptime Kuma Monitoring Update Completed")
+    logger.info("Uptime Kuma Monitoring Update Completed")
 
 
 @click.command()
@@ -462,6 +1091,44 @@ def uptime_kuma_monitor(
     help="JSON file grouping the different items related to the uptime-kuma save_status_page.\n\n see  https://shorturl.at/FHKOP for more information.",
     envvar="UPTIME_KUMA_STATUS_PAGE",
 )
+@click.option(
+    "--status-page-max-group-size",
+    default=None,
+    type=int,
+    help="Split the status page groups with more monitors than this size into numbered groups",
+    envvar="UPTIME_KUMA_STATUS_PAGE_MAX_GROUP_SIZE",
+)
+@click.option(
+    "--monitor-config",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help=(
+        "JSON or YAML file of rules defining the monitors of each dataset and "
+        "their intervals. Default to .uptimekuma.(yml|yaml|json) if available."
+    ),
+    envvar="UPTIME_KUMA_MONITOR_CONFIG",
+)
+@click.option(
+    "--max-requests-per-minute",
+    default=None,
+    type=float,
+    help=(
+        "Budget of requests per minute made by the monitors to ERDDAP, "
+        "dataset monitors intervals are scaled up by a power of 2 to stay within it"
+    ),
+    envvar="UPTIME_KUMA_MAX_REQUESTS_PER_MINUTE",
+)
+@click.option(
+    "--interval-spread",
+    default=0.0,
+    type=float,
+    show_default=True,
+    help=(
+        "Extend each dataset monitor interval by up to this fraction, based on "
+        "a hash of its name, to spread the checks over time (ex: 0.2)"
+    ),
+    envvar="UPTIME_KUMA_INTERVAL_SPREAD",
+)
 @click.option(
     "--delete-monitors",
     default=None,
@@ -489,6 +1156,72 @@ def uptime_kuma_monitor(
     help="Timeout for the API requests",
     envvar="UPTIME_KUMA_TIMEOUT",
 )
+@click.option(
+    "--parallelism",
+    default=1,
+    type=int,
+    show_default=True,
+    help="Number of uptime kuma operations (add, pause, resume, delete) run at once",
+    envvar="UPTIME_KUMA_PARALLELISM",
+)
+@click.option(
+    "--rate-limit",
+    default=None,
+    type=float,
+    help="Maximum number of uptime kuma operations started per second",
+    envvar="UPTIME_KUMA_RATE_LIMIT",
+)
+@click.option(
+    "--retry-attempts",
+    default=3,
+    type=int,
+    show_default=True,
+    help="Maximum number of attempts of an uptime kuma API call that times out or fails to connect",
+    envvar="UPTIME_KUMA_RETRY_ATTEMPTS",
+)
+@click.option(
+    "--retry-backoff",
+    default=1.0,
+    type=float,
+    show_default=True,
+    help="Initial delay in seconds between retries, doubled after each attempt",
+    envvar="UPTIME_KUMA_RETRY_BACKOFF",
+)
+@click.option(
+    "--retry-deadline",
+    default=None,
+    type=float,
+    help="Time in seconds after which failed API calls are not retried anymore",
+    envvar="UPTIME_KUMA_RETRY_DEADLINE",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help=(
+        "Only reconcile the monitors of the datasets changed by a chained sync "
+        "command, or otherwise changed since the last run recorded in "
+        "--state-file, along with the ERDDAP pages monitors. Without a previous "
+        "run, compare against the active datasets.xml or reconcile every monitor"
+    ),
+    envvar="UPTIME_KUMA_INCREMENTAL",
+)
+@click.option(
+    "--full-reconcile-interval",
+    default=24.0,
+    type=float,
+    show_default=True,
+    help="Hours after which an incremental run reconciles every monitor",
+    envvar="UPTIME_KUMA_FULL_RECONCILE_INTERVAL",
+)
+@click.option(
+    "--state-file",
+    default="{bigParentDirectory}/uptime_kuma_monitor.json",
+    type=str,
+    show_default=True,
+    help="File keeping track of the last full reconciliation and datasets, only used with --incremental",
+    envvar="UPTIME_KUMA_STATE_FILE",
+)
 @click.pass_context
 @logger.catch(reraise=True)
 def monitor(
@@ -501,10 +1234,22 @@ def monitor(
     erddap_url: str = None,
     status_page_slug: str = None,
     status_page: Path = None,
+    status_page_max_group_size: int = None,
+    monitor_config: str = None,
+    max_requests_per_minute: float = None,
+    interval_spread: float = 0.0,
     delete_monitors: str = None,
     dry_run: bool = False,
     monitor_kwargs: dict = None,
     timeout: float = 10.0,
+    parallelism: int = 1,
+    rate_limit: float = None,
+    retry_attempts: int = 3,
+    retry_backoff: float = 1.0,
+    retry_deadline: float = None,
+    incremental: bool = False,
+    full_reconcile_interval: float = 24.0,
+    state_file: str = None,
 ):
     """Monitor ERDDAP deployment via uptime kuma status page."""
 
@@ -512,19 +1257,7 @@ def monitor(
         logger.warning("Dry run mode enabled")
 
     logger.info("Monitor ERDDAP deployment with uptime-kuma={}", uptime_kuma_url)
-    if erddap_url is None:
-        logger.debug("Retrieve erddap_url from environment variables")
-        if os.environ.get("ERDDAP_baseHttpsUrl"):
-            erddap_url = os.environ.get("ERDDAP_baseHttpsUrl") + "/erddap"
-            logger.debug("Using erddap_url=ERDDAP_baseHttpsUrl={}", erddap_url)
-        elif os.environ.get("ERDDAP_baseUrl"):
-            erddap_url = os.environ.get("ERDDAP_baseUrl") + "/erddap"
-            logger.debug("Using erddap_url=ERDDAP_baseUrl={}", erddap_url)
-        else:
-            logger.error("ERDDAP_baseUrl or ERDDAP_baseHttpsUrl is required")
-            sys.exit(1)
-    else:
-        logger.debug("Using erddap_url={}", erddap_url)
+    erddap_url = get_erddap_url(erddap_url)
 
     if monitor_kwargs:
         try:
@@ -533,6 +1266,26 @@ def monitor(
             logger.error("Failed to parse monitor_kwargs as JSON")
             sys.exit(1)
 
+    datasets = list(ctx.obj["erddap"].load().datasets.values())
+    changed_datasets = None
+    state_file = state_file.format(**ctx.obj) if incremental and state_file else None
+    if incremental:
+        if "diff" in ctx.obj:
+            logger.info("Use the datasets changes from sync")
+            changed_datasets = set(ctx.obj["diff"])
+        else:
+            changed_datasets = get_changed_datasets(
+                datasets, load_monitor_state(state_file) if state_file else {}
+            )
+            if changed_datasets is not None:
+                logger.info("Compare datasets against the last monitor run")
+        if changed_datasets is None and ctx.obj["active_erddap"].load():
+            logger.info("Compare datasets against the active datasets.xml")
+            diff = ctx.obj["erddap"].diff(ctx.obj["active_erddap"])
+            changed_datasets = set(diff) if diff is not None else None
+        if changed_datasets is None:
+            logger.warning("No datasets changes available, reconcile every monitor")
+
     try:
         uptime_kuma_monitor(
             uptime_kuma_url,
@@ -543,11 +1296,25 @@ def monitor(
             erddap_url=erddap_url,
             status_page_slug=status_page_slug,
             status_page=status_page,
-            datasets=list(ctx.obj["erddap"].load().datasets.values()),
+            datasets=datasets,
             delete_monitors=delete_monitors,
             dry_run=dry_run,
             monitor_kwargs=monitor_kwargs,
             timeout=timeout,
+            parallelism=parallelism,
+            rate_limit=rate_limit,
+            retry_policy=RetryPolicy(
+                max_attempts=retry_attempts,
+                backoff=retry_backoff,
+                deadline=retry_deadline,
+            ),
+            changed_datasets=changed_datasets,
+            state_file=state_file,
+            full_reconcile_interval=full_reconcile_interval,
+            max_group_size=status_page_max_group_size,
+            monitor_rules=MonitorRules.from_file(monitor_config),
+            max_requests_per_minute=max_requests_per_minute,
+            interval_spread=interval_spread,
         )
     except Exception:
         logger.exception("Failed to monitor ERDDAP deployment", exc_info=True)
@@ -0,0 +1,112 @@
+import json
+import re
+from pathlib import Path
+from typing import Union
+
+from loguru import logger
+
+MONITOR_KINDS = ("page", "data", "realtime")
+CONFIG_FILES = (".uptimekuma.yml", ".uptimekuma.yaml", ".uptimekuma.json")
+
+# Monitors generated when no configuration is given
+DEFAULT_CONFIG = {
+    "pages": {"interval": 60},
+    "rules": [
+        {"monitors": {"page": {"interval": 60}}},
+        {
+            "datasetID": "(?i)realtime|real-time|5min",
+            "monitors": {"realtime": {"interval": 3600, "dt": "1day"}},
+        },
+    ],
+}
+
+
+class MonitorRule:
+    """Rule selecting datasets by datasetID, type or global attributes regex
+
+    A dataset matches if every condition given is found (re.search) within
+    the corresponding value. Monitors maps each monitor kind (page, data or
+    realtime) to its settings, or to null to disable it.
+    """
+
+    def __init__(
+        self,
+        monitors: dict,
+        datasetID: str = None,
+        type: str = None,
+        attributes: dict = None,
+    ):
+        unknown_kinds = set(monitors) - set(MONITOR_KINDS)
+        if unknown_kinds:
+            raise ValueError(
+                f"Unknown monitor kinds {unknown_kinds}, expected one of {MONITOR_KINDS}"
+            )
+        self.monitors = monitors
+        self.dataset_id = re.compile(datasetID) if datasetID else None
+        self.type = re.compile(type) if type else None
+        self.attributes = {
+            name: re.compile(pattern) for name, pattern in (attributes or {}).items()
+        }
+
+    def match(self, dataset) -> bool:
+        if self.dataset_id and not self.dataset_id.search(dataset.dataset_id):
+            return False
+        if self.type and not self.type.search(dataset.type):
+            return False
+        for name, pattern in self.attributes.items():
+            value = dataset.attrs.get(name)
+            if value is None or not pattern.search(str(value)):
+                return False
+        return True
+
+
+class MonitorRules:
+    """Monitors to generate for each dataset based on a list of rules
+
+    Every matching rule is applied in order, later rules overriding the
+    settings of the earlier ones.
+    """
+
+    def __init__(self, config: dict = None):
+        config = DEFAULT_CONFIG if config is None else config
+        self.pages = config.get("pages", DEFAULT_CONFIG["pages"])
+        self.rules = [MonitorRule(**rule) for rule in config.get("rules", [])]
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path] = None):
+        """Load rules from a json or yaml file
+
+        If no path is given, look for a .uptimekuma.(yml|yaml|json) file in the
+        working directory and fall back to the default rules.
+        """
+        if path is None:
+            path = next((file for file in CONFIG_FILES if Path(file).exists()), None)
+            if path is None:
+                logger.debug("No monitor configuration found, use default rules")
+                return cls()
+        path = Path(path)
+        logger.info("Load monitor configuration {}", path)
+        text = path.read_text(encoding="UTF-8")
+        if path.suffix in (".yml", ".yaml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    f"PyYAML is required to read {path}, install it or use a json file"
+                )
+            return cls(yaml.safe_load(text))
+        return cls(json.loads(text))
+
+    def get_monitors(self, dataset) -> dict:
+        """Return the settings of each monitor kind to generate for a dataset"""
+        monitors = {}
+        for rule in self.rules:
+            if not rule.match(dataset):
+                continue
+            for kind, settings in rule.monitors.items():
+                if settings is None or settings is False:
+                    monitors.pop(kind, None)
+                else:
+                    settings = settings if isinstance(settings, dict) else {}
+                    monitors[kind] = {**monitors.get(kind, {}), **settings}
+        return monitors
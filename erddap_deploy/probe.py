@@ -0,0 +1,335 @@
+import asyncio
+import json
+import ssl
+import statistics
+import sys
+import time
+from collections import Counter
+from urllib.parse import quote, urljoin, urlsplit
+
+import click
+from loguru import logger
+
+from erddap_deploy.monitor import ErddapMonitor, get_erddap_url
+from erddap_deploy.monitor_rules import MonitorRules
+
+USER_AGENT = "erddap-deploy-probe"
+MAX_REDIRECTS = 5
+NO_BODY_STATUS = (204, 304)
+
+
+class HostRateLimiter:
+    """Space out requests to each host to at most rate requests per second"""
+
+    def __init__(self, rate: float = None):
+        self.interval = 1 / rate if rate else 0
+        self.next_times = {}
+        self.lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            next_time = max(now, self.next_times.get(host, now))
+            self.next_times[host] = next_time + self.interval
+        if next_time > now:
+            await asyncio.sleep(next_time - now)
+
+
+class ConnectionPool:
+    """Minimal asyncio HTTP/1.1 client reusing keep-alive connections per host
+
+    Only GET requests are supported, response bodies are read and discarded
+    to measure the complete response time.
+    """
+
+    def __init__(self):
+        self.idle = {}
+        self.opened = 0
+
+    async def _connect(self, scheme: str, host: str, port: int):
+        self.opened += 1
+        return await asyncio.open_connection(
+            host,
+            port,
+            ssl=ssl.create_default_context() if scheme == "https" else None,
+        )
+
+    async def _read_body(self, reader, status: int, headers: dict) -> int:
+        if status < 200 or status in NO_BODY_STATUS:
+            # no body whatever the headers say (RFC 7230 section 3.3.3)
+            return 0
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            size = 0
+            while True:
+                chunk_size = int((await reader.readline()).split(b";")[0], 16)
+                if chunk_size == 0:
+                    # skip trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return size
+                await reader.readexactly(chunk_size + 2)
+                size += chunk_size
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            await reader.readexactly(length)
+            return length
+        return len(await reader.read())
+
+    async def _request(self, reader, writer, host: str, target: str):
+        writer.write(
+            (
+                f"GET {target} HTTP/1.1\r\n"
+                f"Host: {host}\r\n"
+                f"User-Agent: {USER_AGENT}\r\n"
+                "Accept-Encoding: identity\r\n"
+                "Connection: keep-alive\r\n\r\n"
+            ).encode("latin-1")
+        )
+        await writer.drain()
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError("Connection closed by server")
+            version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+            status = int(status)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line in ("\r\n", "\n", ""):
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            # skip interim responses (ex: 100 Continue) until the final one
+            if not 100 <= status < 200 or status == 101:
+                break
+        size = await self._read_body(reader, status, headers)
+        keep_alive = (
+            version == "HTTP/1.1"
+            and headers.get("connection", "").lower() != "close"
+            and (
+                status in NO_BODY_STATUS
+                or "content-length" in headers
+                or "transfer-encoding" in headers
+            )
+        )
+        return status, size, keep_alive, headers.get("location")
+
+    async def get(self, url: str):
+        """GET url and return its status code, body size and Location header"""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = quote(
+            parts.path + (f"?{parts.query}" if parts.query else ""),
+            safe="/?&=%:;,+-_.!~*'()@$",
+        )
+        idle = self.idle.setdefault(key, [])
+        while True:
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._connect(*key)
+            try:
+                status, size, keep_alive, location = await self._request(
+                    reader, writer, parts.netloc, target
+                )
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # the server closed an idle connection, retry with a new one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, size, location
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle = {}
+
+
+async def probe_urls(
+    monitors: list,
+    concurrency: int = 10,
+    rate_limit: float = None,
+    timeout: float = 30,
+) -> list:
+    """Request each monitor url and return its status code and latency
+
+    At most concurrency requests run at once and rate_limit requests per
+    second are sent to each host. Redirects are followed up to MAX_REDIRECTS
+    times and a monitor is ok if its final status is 2xx.
+    """
+    pool = ConnectionPool()
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = HostRateLimiter(rate_limit)
+
+    async def get(url: str, redirects: list):
+        while True:
+            await rate_limiter.wait(urlsplit(url).hostname)
+            status, size, location = await pool.get(url)
+            if not (300 <= status < 400 and location) or (
+                len(redirects) >= MAX_REDIRECTS
+            ):
+                return status, size
+            url = urljoin(url, location)
+            redirects.append(url)
+
+    async def probe(monitor):
+        result = dict(name=monitor["name"], url=monitor["url"], redirects=[])
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                result["status"], result["size"] = await asyncio.wait_for(
+                    get(monitor["url"], result["redirects"]), timeout
+                )
+                result["error"] = None
+            except Exception as e:
+                result.update(status=None, size=None, error=repr(e))
+            result["latency"] = time.perf_counter() - start_time
+        result["ok"] = result["status"] is not None and 200 <= result["status"] < 300
+        return result
+
+    try:
+        return await asyncio.gather(*(probe(monitor) for monitor in monitors))
+    finally:
+        logger.debug("Opened {} connections", pool.opened)
+        pool.close()
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def summarize(results: list) -> dict:
+    """Summary of the probe results with latency percentiles in seconds"""
+    latencies = sorted(result["latency"] for result in results)
+    return dict(
+        total=len(results),
+        ok=sum(result["ok"] for result in results),
+        failed=sum(not result["ok"] for result in results),
+        status=dict(Counter(str(result["status"]) for result in results)),
+        latency=dict(
+            p50=percentile(latencies, 50),
+            p90=percentile(latencies, 90),
+            p99=percentile(latencies, 99),
+            max=latencies[-1] if latencies else None,
+        ),
+    )
+
+
+def probe_erddap(
+    erddap_url: str,
+    datasets: list,
+    erddap_name: str = None,
+    monitor_rules: MonitorRules = None,
+    concurrency: int = 10,
+    rate_limit: float = None,
+    timeout: float = 30,
+) -> list:
+    """Probe the ERDDAP pages and the urls of the monitors of each active dataset"""
+    erddap_monitor = ErddapMonitor(
+        api=None,
+        erddap_name=erddap_name,
+        erddap_url=erddap_url,
+        status_page_slug=None,
+        status_page=None,
+        datasets=datasets,
+        rules=monitor_rules,
+    )
+    monitors = [
+        monitor
+        for monitor in erddap_monitor.generate_monitors()
+        if monitor["active"] in (True, "true")
+    ]
+    logger.info("Probe {} urls", len(monitors))
+    return asyncio.run(
+        probe_urls(
+            monitors, concurrency=concurrency, rate_limit=rate_limit, timeout=timeout
+        )
+    )
+
+
+@click.command()
+@click.option(
+    "--erddap-url",
+    type=str,
+    default=None,
+    help="ERDDAP url to probe, default to ERDDAP_baseHttpsUrl or ERDDAP_baseUrl",
+)
+@click.option(
+    "--monitor-config",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON or YAML file of rules defining the urls checked for each dataset (see monitor)",
+    envvar="UPTIME_KUMA_MONITOR_CONFIG",
+)
+@click.option(
+    "--concurrency",
+    default=10,
+    type=int,
+    show_default=True,
+    help="Number of requests running at once",
+    envvar="ERDDAP_PROBE_CONCURRENCY",
+)
+@click.option(
+    "--rate-limit",
+    default=None,
+    type=float,
+    help="Maximum number of requests per second sent to each host",
+    envvar="ERDDAP_PROBE_RATE_LIMIT",
+)
+@click.option(
+    "--timeout",
+    default=30.0,
+    type=float,
+    show_default=True,
+    help="Timeout of each request in seconds",
+    envvar="ERDDAP_PROBE_TIMEOUT",
+)
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Save the JSON report of every request to this file",
+)
+@click.pass_context
+@logger.catch(reraise=True)
+def probe(ctx, erddap_url, monitor_config, concurrency, rate_limit, timeout, output):
+    """Check the ERDDAP pages and datasets directly without uptime kuma."""
+    erddap_url = get_erddap_url(erddap_url)
+    results = probe_erddap(
+        erddap_url,
+        list(ctx.obj["erddap"].load().datasets.values()),
+        monitor_rules=MonitorRules.from_file(monitor_config),
+        concurrency=concurrency,
+        rate_limit=rate_limit,
+        timeout=timeout,
+    )
+    summary = summarize(results)
+    if output:
+        with open(output, "w", encoding="UTF-8") as file:
+            json.dump(dict(summary=summary, results=results), file, indent=2)
+    for result in results:
+        if not result["ok"]:
+            logger.error(
+                "{} failed: status={} error={}",
+                result["url"],
+                result["status"],
+                result["error"],
+            )
+    logger.info("Probe summary: {}", json.dumps(summary))
+    if summary["failed"]:
+        sys.exit(1)
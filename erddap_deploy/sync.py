@@ -1,12 +1,17 @@
 import os
+import signal
 import sys
 from pathlib import Path
 
 import click
 from dotenv import load_dotenv
-from git import Repo
+from git import GitCommandError, Repo
 from loguru import logger
 
+from erddap_deploy.flags import FlagScheduler
+from erddap_deploy.manifest import diff_manifest, load_manifest, save_manifest
+from erddap_deploy.watch import SyncWatcher
+
 load_dotenv()
 
 
@@ -44,6 +49,36 @@ def get_erddap_env_variables():
     is_flag=True,
     envvar="ERDDAP_DATASETS_REPO_PULL",
 )
+@click.option(
+    "--clone-depth",
+    help="Create a shallow clone of the repo with this number of commits",
+    type=int,
+    default=None,
+    envvar="ERDDAP_DATASETS_REPO_DEPTH",
+)
+@click.option(
+    "--single-branch",
+    help="Only clone the history of the branch synced",
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_DATASETS_REPO_SINGLE_BRANCH",
+)
+@click.option(
+    "--clone-filter",
+    help="Partial clone filter (ex: blob:none to download files content on demand)",
+    type=str,
+    default=None,
+    envvar="ERDDAP_DATASETS_REPO_FILTER",
+)
+@click.option(
+    "--sparse",
+    help="Only checkout the repo files matching the --datasets-xml search paths",
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_DATASETS_REPO_SPARSE",
+)
 @click.option(
     "-p",
     "--local-repo-path",
@@ -61,6 +96,25 @@ def get_erddap_env_variables():
     is_flag=True,
     envvar="ERDDAP_HARD_FLAG",
 )
+@click.option(
+    "--flag",
+    help=(
+        "Generate a soft flag for datasets with metadata only changes "
+        "(addAttributes) and a hard flag for the other modified datasets"
+    ),
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_FLAG",
+)
+@click.option(
+    "--flag-dir",
+    help="Directory to save soft flag",
+    type=str,
+    default="{bigParentDirectory}/flag",
+    envvar="ERDDAP_FLAG_DIR",
+    show_default=True,
+)
 @click.option(
     "--hard-flag-dir",
     help="Directory to save hard flag",
@@ -69,6 +123,117 @@ def get_erddap_env_variables():
     envvar="ERDDAP_HARD_FLAG_DIR",
     show_default=True,
 )
+@click.option(
+    "--flag-batch-size",
+    help="Number of flags written at once, all at once if not provided",
+    type=int,
+    default=None,
+    envvar="ERDDAP_FLAG_BATCH_SIZE",
+)
+@click.option(
+    "--flag-batch-interval",
+    help="Seconds to wait between flags batches",
+    type=float,
+    default=0,
+    show_default=True,
+    envvar="ERDDAP_FLAG_BATCH_INTERVAL",
+)
+@click.option(
+    "--flag-priority",
+    help=(
+        "Comma separated dataset types (or type prefixes) flagged first "
+        "(ex: EDDTableFromDatabase,EDDGrid), smaller datasets are flagged first "
+        "within each type"
+    ),
+    type=str,
+    default=None,
+    envvar="ERDDAP_FLAG_PRIORITY",
+)
+@click.option(
+    "--flag-wait",
+    help=(
+        "Wait for ERDDAP to process each flags batch (flags deleted and "
+        "--flag-status-url available) before writing the next one"
+    ),
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_FLAG_WAIT",
+)
+@click.option(
+    "--flag-status-url",
+    help="ERDDAP url polled while waiting for a flags batch (ex: http://localhost:8080/erddap/status.html)",
+    type=str,
+    default=None,
+    envvar="ERDDAP_FLAG_STATUS_URL",
+)
+@click.option(
+    "--flag-timeout",
+    help="Maximum time in seconds to wait for a flags batch to be processed",
+    type=float,
+    default=600,
+    show_default=True,
+    envvar="ERDDAP_FLAG_TIMEOUT",
+)
+@click.option(
+    "--ignore-manifest",
+    help=(
+        "Compare against the full active datasets.xml even if its manifest "
+        "(datasets.xml.manifest.json) is up to date"
+    ),
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_IGNORE_MANIFEST",
+)
+@click.option(
+    "--incremental",
+    help=(
+        "Only parse the datasets.xml files changed in the datasets repo since "
+        "the commit recorded in the active datasets.xml manifest, the other "
+        "files are only read and their datasets are assumed unchanged"
+    ),
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_SYNC_INCREMENTAL",
+)
+@click.option(
+    "--watch",
+    help=(
+        "Keep running and sync again each time the datasets.xml files or the "
+        "git remote (with --pull) change. The first sync parses every file and "
+        "the following ones only parse the changed files, the parsed datasets "
+        "of the others are kept in memory"
+    ),
+    type=bool,
+    default=False,
+    is_flag=True,
+    envvar="ERDDAP_SYNC_WATCH",
+)
+@click.option(
+    "--watch-interval",
+    help="Interval in seconds between each check for changes in watch mode",
+    type=float,
+    default=60,
+    show_default=True,
+    envvar="ERDDAP_SYNC_WATCH_INTERVAL",
+)
+@click.option(
+    "--watch-debounce",
+    help="Wait for no more changes during this many seconds before syncing",
+    type=float,
+    default=5,
+    show_default=True,
+    envvar="ERDDAP_SYNC_WATCH_DEBOUNCE",
+)
+@click.option(
+    "--status-port",
+    help="Serve the watch mode status (last sync time, duration and error) as JSON on this local port",
+    type=int,
+    default=None,
+    envvar="ERDDAP_SYNC_STATUS_PORT",
+)
 @click.pass_context
 @logger.catch(reraise=True)
 def sync(
@@ -76,9 +241,27 @@ def sync(
     repo_url,
     branch,
     pull,
+    clone_depth,
+    single_branch,
+    clone_filter,
+    sparse,
     local_repo_path,
     hard_flag,
+    flag,
+    flag_dir,
     hard_flag_dir,
+    flag_batch_size,
+    flag_batch_interval,
+    flag_priority,
+    flag_wait,
+    flag_status_url,
+    flag_timeout,
+    ignore_manifest,
+    incremental,
+    watch,
+    watch_interval,
+    watch_debounce,
+    status_port,
 ):
     """Sync datasets.xml from a git repo"""
 
@@ -86,44 +269,186 @@ def sync(
     path_vars = get_erddap_env_variables()
     path_vars.update(ctx.obj)
     local_repo_path = local_repo_path.format(**path_vars)
+    flag_dir = Path(flag_dir.format(**path_vars))
     hard_flag_dir = Path(hard_flag_dir.format(**path_vars))
 
-    # Get repo if not available and checkout branch and pull
-    update_local_repository(repo_url, branch, pull, local_repo_path)
+    def run_sync(incremental):
+        # Get repo if not available and checkout branch and pull
+        repo = update_local_repository(
+            repo_url,
+            branch,
+            pull,
+            local_repo_path,
+            depth=clone_depth,
+            single_branch=single_branch,
+            filter=clone_filter,
+            sparse_patterns=(
+                get_sparse_patterns(ctx.obj["datasets_xml"], local_repo_path)
+                if sparse
+                else None
+            ),
+        )
+        commit = repo.head.commit.hexsha
 
-    # compare active dataset vs HEAD
-    logger.info("Compare active dataset vs HEAD")
-    ctx.obj["erddap"].load()
-    erddap = ctx.obj["erddap"]
-    active_erddap = ctx.obj["active_erddap"].load()
+        manifest = (
+            None if ignore_manifest else load_manifest(ctx.obj["active_datasets_xml"])
+        )
+        sources = None
+        if incremental and manifest and manifest.get("commit"):
+            sources = get_incremental_sources(
+                repo, manifest["commit"], ctx.obj["erddap"].get_xml_files()
+            )
+        elif incremental:
+            logger.info("No manifest commit available, run a full sync")
 
-    if not erddap.datasets_xml:
-        logger.error("Unable to sync since no datasets.xml found")
-        sys.exit(1)
+        # compare active dataset vs HEAD
+        logger.info("Compare active dataset vs HEAD")
+        erddap = ctx.obj["erddap"].load(parse_only=sources)
+        if not erddap:
+            logger.error("Unable to sync since no datasets.xml found")
+            return None
+
+        if sources is not None:
+            logger.info("Compare changed files against active datasets.xml manifest")
+            diff = diff_manifest(erddap, manifest, sources=sources)
+        elif manifest:
+            logger.info("Compare against active datasets.xml manifest")
+            diff = diff_manifest(erddap, manifest)
+        else:
+            active_erddap = ctx.obj["active_erddap"].load()
+            if not active_erddap:
+                logger.info("Save active datasets.xml")
+                erddap.save(ctx.obj["active_datasets_xml"])
+                diff = {id: None for id in erddap.datasets.keys()}
+            else:
+                diff = erddap.diff(active_erddap)
+
+        # share the changed datasets with chained commands (ex: monitor --incremental)
+        ctx.obj["diff"] = diff
+
+        # If any differences, update datasets.xml
+        if diff:
+            logger.info("Update datasets.xml")
+            erddap.save(
+                ctx.obj["active_datasets_xml"],
+                source="original" if sources is not None else None,
+            )
+        if diff or not manifest or manifest.get("commit") != commit:
+            save_manifest(
+                erddap,
+                ctx.obj["active_datasets_xml"],
+                commit=commit,
+                previous=manifest if sources is not None else None,
+                sources=sources,
+            )
+
+        if hard_flag or flag:
+            flag_scheduler = FlagScheduler(
+                flag_dir,
+                hard_flag_dir,
+                batch_size=flag_batch_size,
+                interval=flag_batch_interval,
+                priority=flag_priority.split(",") if flag_priority else None,
+                wait=flag_wait,
+                status_url=flag_status_url,
+                timeout=flag_timeout,
+            )
+            flag_scheduler.run(diff, erddap.datasets, force_hard=hard_flag)
+
+        logger.info("datasets.xml updated")
+        return diff
+
+    if not watch:
+        if run_sync(incremental) is None:
+            sys.exit(1)
+        return
+
+    watcher = SyncWatcher(
+        lambda: run_sync(watcher.get_status()["runs"] > 0),
+        lambda: ctx.obj["erddap"].get_xml_files(verbose=False),
+        repo_path=local_repo_path,
+        pull=pull,
+        interval=watch_interval,
+        debounce=watch_debounce,
+        status_port=status_port,
+        get_datasets=lambda: ctx.obj["erddap"].datasets,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    watcher.run()
+
+
+def get_incremental_sources(repo: Repo, commit: str, xml_files: list):
+    """Get the resolved paths of the datasets.xml files to parse in an incremental sync
+
+    Files changed in the repo working tree since commit, including deleted and
+    untracked ones, and files outside of the repo are parsed. Return None if
+    the changes since commit can't be retrieved.
+    """
+    repo_dir = Path(repo.working_tree_dir).resolve()
+    try:
+        changed_files = repo.git.diff("--name-only", "--no-renames", commit)
+    except GitCommandError as e:
+        logger.warning("Failed to get changes since {}, run a full sync: {}", commit, e)
+        return None
+    sources = {
+        repo_dir / file
+        for file in changed_files.splitlines() + repo.untracked_files
+        if file
+    }
+    sources.update(
+        path
+        for path in map(lambda file: Path(file).resolve(), xml_files)
+        if not path.is_relative_to(repo_dir)
+    )
+    logger.info(
+        "{} files changed since {}: {}",
+        len(sources),
+        commit,
+        sorted(str(source) for source in sources),
+    )
+    return sources
 
-    if not active_erddap:
-        logger.info("Save active datasets.xml")
-        erddap.save(ctx.obj["active_datasets_xml"])
-        diff = {id: None for id in erddap.datasets.keys()}
-    else:
-        diff = erddap.diff(active_erddap)
 
-    # If any differences, update datasets.xml
-    if diff:
-        logger.info("Update datasets.xml")
-        erddap.save(ctx.obj["active_datasets_xml"])
+def get_sparse_patterns(datasets_xml: str, local: str) -> list:
+    """Convert the datasets_xml search paths to sparse-checkout patterns within the local repo
 
-    if hard_flag:
-        for datasetID, datasetDiff in diff.items():
-            logger.info("Generate hard flag for {}", datasetID)
-            logger.debug("Diff: {}", datasetDiff)
-            (hard_flag_dir / datasetID).write_text("")
+    Search paths within the local repo are anchored to its root, search paths
+    starting with ** above it match anywhere in the repo and others are ignored.
+    """
+    local = Path(local).absolute()
+    patterns = []
+    for search in datasets_xml.split("|"):
+        parts = Path(search).absolute().parts
+        static = next(
+            (i for i, part in enumerate(parts) if any(c in part for c in "*?[")),
+            len(parts),
+        )
+        prefix, rest = Path(*parts[:static]), parts[static:]
+        if prefix.is_relative_to(local):
+            patterns.append("/" + Path(prefix.relative_to(local), *rest).as_posix())
+        elif local.is_relative_to(prefix) and rest and rest[0] == "**":
+            patterns.append("/".join(rest))
+        else:
+            logger.warning("Search path {} is outside of the repo {}", search, local)
+    return patterns
 
-    logger.info("datasets.xml updated")
 
+def update_local_repository(
+    repo_url,
+    branch,
+    pull,
+    local,
+    depth: int = None,
+    single_branch: bool = False,
+    filter: str = None,
+    sparse_patterns: list = None,
+):
+    """Get repo if not available and checkout branch and pull
 
-def update_local_repository(repo_url, branch, pull, local):
-    """Get repo if not available and checkout branch and pull"""
+    A new clone can be shallow (depth), limited to a single branch, partial
+    (filter) and restricted to the files matching sparse_patterns. Pulls of a
+    shallow clone only fetch the new commits.
+    """
 
     logger.debug(
         "List local repository files: {} ls  = {}", local, list(Path(local).glob("*"))
@@ -136,8 +461,23 @@ def update_local_repository(repo_url, branch, pull, local):
     if not repo_url and not Path(local).exists():
         raise ValueError("Repo or local path is required")
     if not Path(local).exists() or not list(Path(local).glob("**/*")):
-        logger.info(f"Clone repo {repo_url} to {local}")
-        repo = Repo.clone_from(repo_url, local)
+        clone_options = dict(
+            depth=depth,
+            single_branch=single_branch or None,
+            branch=branch,
+            filter=filter,
+            sparse=bool(sparse_patterns) or None,
+        )
+        clone_options = {
+            key: value for key, value in clone_options.items() if value is not None
+        }
+        logger.info(f"Clone repo {repo_url} to {local} with {clone_options}")
+        repo = Repo.clone_from(repo_url, local, **clone_options)
+        if sparse_patterns:
+            logger.info("Sparse checkout {}", sparse_patterns)
+            repo.git.sparse_checkout("set", "--no-cone", *sparse_patterns)
+        elif sparse_patterns is not None:
+            logger.warning("No sparse-checkout pattern found, checkout every file")
     else:
         repo = Repo(local)
         origin_url = repo.git.remote("get-url", "origin")
@@ -158,6 +498,7 @@ def update_local_repository(repo_url, branch, pull, local):
     if pull:
         logger.info("Pull from remote")
         repo.git.pull()
+    return repo
 
 
 if __name__ == "__main__":
@@ -4,6 +4,33 @@ import click
 import pytest
 from loguru import logger
 
+from erddap_deploy.erddap import Erddap
+
+ERDDAP_KEY = pytest.StashKey[Erddap]()
+
+
+class ErddapPlugin:
+    """Pytest plugin sharing an already loaded Erddap object with the tests"""
+
+    def __init__(self, erddap: Erddap):
+        self.erddap = erddap
+
+    def pytest_configure(self, config):
+        config.stash[ERDDAP_KEY] = self.erddap
+
+
+def get_erddap(config) -> Erddap:
+    """Get the Erddap object tested, loaded once per pytest session
+
+    Default to the datasets.xml defined by ERDDAP_DATASETS_XML if not provided
+    by the ErddapPlugin.
+    """
+    if ERDDAP_KEY not in config.stash:
+        config.stash[ERDDAP_KEY] = Erddap(
+            os.environ.get("ERDDAP_DATASETS_XML", "tests/data/datasets.d/*.xml")
+        )
+    return config.stash[ERDDAP_KEY]
+
 
 @click.command()
 @click.option(
@@ -25,16 +52,20 @@ from loguru import logger
 @click.pass_context
 @logger.catch(reraise=True)
 def test(ctx, test_filter, active):
-    """Run a series of tests on repo ERDDAP datasets"""
+    """Run a series of tests on repo ERDDAP datasets
+
+    Datasets already loaded by a chained command are reused, unless only some
+    of them were (ex: sync --incremental), then all of them are loaded again.
+    """
 
-    os.environ["ERDDAP_DATASETS_XML"] = (
-        ctx.obj["active_datasets_xml"] if active else ctx.obj["datasets_xml"]
-    )
+    erddap = ctx.obj["active_erddap"] if active else ctx.obj["erddap"]
+    if not erddap.nodes or erddap.partial:
+        erddap.load()
 
     args = ["--pyargs", "erddap_deploy"]
     if test_filter:
         args.extend(["-k", test_filter])
     logger.info(f"Run pytest.main({args})")
-    result = pytest.main(args).value
+    result = pytest.main(args, plugins=[ErddapPlugin(erddap)]).value
     if result:
         raise SystemExit(result)
@@ -0,0 +1,20 @@
+import pytest
+
+from erddap_deploy.test import get_erddap
+
+
+def pytest_generate_tests(metafunc):
+    if "dataset" in metafunc.fixturenames:
+        datasets = get_erddap(metafunc.config).datasets
+        metafunc.parametrize(
+            "dataset",
+            datasets.values(),
+            ids=datasets.keys(),
+            indirect=True,
+            scope="module",
+        )
+
+
+@pytest.fixture(scope="session")
+def erddap(request):
+    yield get_erddap(request.config)
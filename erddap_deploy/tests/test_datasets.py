@@ -3,16 +3,10 @@ import os
 import pytest
 from loguru import logger
 
-from erddap_deploy.erddap import CDM_DATA_TYPES, IOOS_CATEGORIES, Erddap
+from erddap_deploy.erddap import CDM_DATA_TYPES, IOOS_CATEGORIES
 
-erddap = Erddap(os.environ.get("ERDDAP_DATASETS_XML", "tests/data/datasets.d/*.xml"))
 
-
-@pytest.fixture(
-    scope="module",
-    params=erddap.datasets.values(),
-    ids=erddap.datasets.keys(),
-)
+@pytest.fixture(scope="module")
 def dataset(request):
     yield request.param
     logger.info(f"Finished testing {request.param.dataset_id}")
@@ -36,7 +30,7 @@ class TestDatasetGlobalAttributes:
         unknown_variables = [
             var
             for var in subset_variables
-            if var.strip() not in dataset.get_variables_destination_names() and var
+            if var.strip() not in dataset.variables_by_destination_name and var
         ]
         assert (
             not unknown_variables
@@ -62,7 +56,7 @@ class TestDatasetGlobalAttributes:
         unknown_variables = [
             var
             for var in cdm_timeseries_variables
-            if var.strip() not in dataset.get_variables_destination_names() and var
+            if var.strip() not in dataset.variables_by_destination_name and var
         ]
         assert (
             not unknown_variables
@@ -83,7 +77,7 @@ class TestDatasetGlobalAttributes:
         unknown_variables = [
             var
             for var in cdm_profile_variables
-            if var.strip() not in dataset.get_variables_destination_names() and var
+            if var.strip() not in dataset.variables_by_destination_name and var
         ]
         assert (
             not unknown_variables
@@ -99,7 +93,7 @@ class TestDatasetsVariablesAttributes:
         if not ioos_category_required:
             return
 
-        for variable in dataset.variables.values():
+        for variable in dataset.variables:
             if variable.destination_name in ("latitude", "longitude", "time", "depth"):
                 continue
             assert (
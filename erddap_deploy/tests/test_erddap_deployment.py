@@ -1,17 +1,4 @@
-import os
-
-import pytest
-
-from erddap_deploy.erddap import EDD_TYPES, Erddap
-
-erddap_test = Erddap(
-    os.environ.get("ERDDAP_DATASETS_XML", "tests/data/datasets.d/*.xml")
-)
-
-
-@pytest.fixture(scope="module")
-def erddap():
-    yield erddap_test
+from erddap_deploy.erddap import EDD_TYPES
 
 
 class TestDatasets:
@@ -23,7 +10,8 @@ class TestDatasets:
 
     def test_datasets_xml(self, erddap):
         """Test that datasets_xml is not empty"""
-        assert erddap.datasets_xml, "datasets_xml is empty"
+        assert erddap.nodes, "datasets_xml is empty"
+        assert erddap.stream or erddap.datasets_xml, "datasets_xml is empty"
 
     def test_datasets(self, erddap):
         """Test that datasets is not empty"""
@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from git import GitCommandError, Repo
+from loguru import logger
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Respond to any GET request with the watcher status as JSON
+
+    The response status is 503 if the last sync failed.
+    """
+
+    def do_GET(self):
+        status = self.server.watcher.get_status()
+        body = json.dumps(status).encode("UTF-8")
+        self.send_response(503 if status["state"] == "error" else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Status request: " + format, *args)
+
+
+class SyncWatcher:
+    """Run a sync each time the datasets.xml files or the git remote change
+
+    The files returned by get_files are polled every interval seconds, and if
+    pull is enabled the repo remote is fetched to detect new commits. Once a
+    change is detected, the sync only runs after no other change was seen for
+    debounce seconds, so that a burst of changes (ex: many files saved or
+    checked out) results in a single sync. If get_datasets is given, the status
+    also reports the number of datasets of the catalog kept in memory.
+    """
+
+    def __init__(
+        self,
+        sync,
+        get_files,
+        repo_path: str = None,
+        pull: bool = False,
+        interval: float = 60,
+        debounce: float = 5,
+        status_port: int = None,
+        status_host: str = "127.0.0.1",
+        get_datasets=None,
+    ):
+        self.sync = sync
+        self.get_files = get_files
+        self.get_datasets = get_datasets
+        self.repo_path = repo_path
+        self.pull = pull
+        self.interval = interval
+        self.debounce = debounce
+        self.status_port = status_port
+        self.status_host = status_host
+        self.server = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.status = dict(
+            state="starting",
+            runs=0,
+            last_sync=None,
+            last_duration=None,
+            last_changes=None,
+            last_error=None,
+            last_success=None,
+            datasets=None,
+        )
+
+    def get_status(self) -> dict:
+        with self.lock:
+            return dict(self.status)
+
+    def get_remote_commit(self) -> str:
+        """Fetch the repo remote and return the commit of the tracked branch"""
+        if not (self.pull and self.repo_path):
+            return None
+        try:
+            repo = Repo(self.repo_path)
+            repo.remote().fetch()
+            return repo.git.rev_parse("@{upstream}")
+        except (GitCommandError, ValueError) as e:
+            logger.warning("Failed to fetch {}: {}", self.repo_path, e)
+            return None
+
+    def get_snapshot(self) -> tuple:
+        """Modification time and size of each file along with the remote commit"""
+        files = {}
+        for file in self.get_files():
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            files[file] = (stat.st_mtime_ns, stat.st_size)
+        return files, self.get_remote_commit()
+
+    def wait_until_stable(self, snapshot: tuple) -> bool:
+        """Wait until the snapshot stays the same for debounce seconds
+
+        Returns:
+            bool: False if the watcher was stopped meanwhile
+        """
+        while not self.stop_event.wait(self.debounce):
+            new_snapshot = self.get_snapshot()
+            if new_snapshot == snapshot:
+                return True
+            logger.debug("Changes still in progress, wait {}s", self.debounce)
+            snapshot = new_snapshot
+        return False
+
+    def sync_once(self) -> dict:
+        """Run the sync and record its outcome in the status"""
+        with self.lock:
+            self.status["state"] = "syncing"
+        start_time = time.monotonic()
+        diff, error = None, None
+        try:
+            diff = self.sync()
+            if diff is None:
+                error = "Sync failed"
+        except Exception as e:
+            logger.exception("Sync failed")
+            error = repr(e)
+        duration = time.monotonic() - start_time
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.lock:
+            self.status.update(
+                state="error" if error else "idle",
+                runs=self.status["runs"] + 1,
+                last_sync=now,
+                last_duration=round(duration, 3),
+                last_changes=len(diff) if diff is not None else None,
+                last_error=error,
+            )
+            if not error:
+                self.status["last_success"] = now
+            if self.get_datasets is not None:
+                self.status["datasets"] = len(self.get_datasets())
+        logger.info("Sync finished in {:.3f}s", duration)
+        return diff
+
+    def start_status_server(self) -> ThreadingHTTPServer:
+        self.server = server = ThreadingHTTPServer(
+            (self.status_host, self.status_port), StatusHandler
+        )
+        server.daemon_threads = True
+        server.watcher = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("Serve sync status on http://{}:{}", *server.server_address[:2])
+        return server
+
+    def run(self):
+        """Sync once and then each time changes are detected until stopped"""
+        server = self.start_status_server() if self.status_port is not None else None
+        try:
+            self.sync_once()
+            snapshot = self.get_snapshot()
+            logger.info("Watch {} files every {}s", len(snapshot[0]), self.interval)
+            while not self.stop_event.wait(self.interval):
+                new_snapshot = self.get_snapshot()
+                if new_snapshot == snapshot:
+                    continue
+                logger.info("Changes detected, wait {}s for more", self.debounce)
+                if not self.wait_until_stable(new_snapshot):
+                    break
+                self.sync_once()
+                # snapshot after the sync to ignore the files it pulled
+                snapshot = self.get_snapshot()
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+            logger.info("Stop watching")
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,118 @@
+import shutil
+import xml.etree.ElementTree as ET
+
+from erddap_deploy import erddap as erddap_module
+from erddap_deploy.cache import ParseCache
+from erddap_deploy.erddap import Erddap
+
+
+def test_parse_cache_get_set(tmp_path):
+    cache = ParseCache(tmp_path)
+    assert cache.get("file.xml", "hash") is None
+    cache.set("file.xml", "hash", {"nodes": []})
+    assert cache.get("file.xml", "hash") == {"nodes": []}
+    assert cache.get("file.xml", "other-hash") is None
+    assert cache.hits == 1
+    assert cache.misses == 2
+
+
+def test_parse_cache_evict(tmp_path):
+    cache = ParseCache(tmp_path, max_size=0)
+    cache.set("file.xml", "hash", {"nodes": []})
+    cache.evict()
+    assert cache.get("file.xml", "hash") is None
+
+
+def test_parse_cache_clear(tmp_path):
+    cache = ParseCache(tmp_path)
+    cache.set("file.xml", "hash", {"nodes": []})
+    cache.clear()
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_erddap_load_with_cache(tmp_path):
+    datasets_d = tmp_path / "datasets.d"
+    shutil.copytree("tests/data/datasets.d", datasets_d)
+    reference = Erddap(str(datasets_d / "**/*.xml"), secrets={"TEST_SECRET": "VALUE"})
+
+    cold = Erddap(
+        str(datasets_d / "**/*.xml"),
+        secrets={"TEST_SECRET": "VALUE"},
+        cache=ParseCache(tmp_path / "cache"),
+    )
+    assert cold.cache.misses == 5 and cold.cache.hits == 0
+
+    (datasets_d / "dataset1.xml").write_text(
+        (datasets_d / "dataset1.xml").read_text().replace(">title<", ">new title<")
+    )
+    warm = Erddap(
+        str(datasets_d / "**/*.xml"),
+        secrets={"TEST_SECRET": "VALUE"},
+        cache=ParseCache(tmp_path / "cache"),
+    )
+    assert warm.cache.misses == 1 and warm.cache.hits == 4
+    assert warm.datasets["dataset1"].attrs["title"] == "new title"
+    assert warm.datasets_xml.replace(">new title<", ">title<") == reference.datasets_xml
+    for dataset_id in ("dataset2", "dataset3", "dataset4"):
+        dataset = warm.datasets[dataset_id]
+        expected = reference.datasets[dataset_id]
+        assert dataset.to_xml() == expected.to_xml()
+        assert dataset.attrs == expected.attrs
+        assert dataset.get_variables_destination_names() == (
+            expected.get_variables_destination_names()
+        )
+
+
+def test_erddap_cache_invalidated_by_secrets(tmp_path):
+    cache_dir = tmp_path / "cache"
+    Erddap("tests/data/datasets.d/*.xml", cache=ParseCache(cache_dir))
+    erddap = Erddap(
+        "tests/data/datasets.d/*.xml",
+        secrets={"TEST_SECRET": "VALUE"},
+        cache=ParseCache(cache_dir),
+    )
+    assert erddap.cache.hits == 0
+    assert erddap.datasets["dataset2"].attrs["title"] == "VALUE"
+
+
+def test_erddap_load_stream_cache_parse_only(tmp_path):
+    datasets_d = tmp_path / "datasets.d"
+    shutil.copytree("tests/data/datasets.d", datasets_d)
+    Erddap(str(datasets_d / "*.xml"), cache=ParseCache(tmp_path / "cache"))
+
+    erddap = Erddap(
+        str(datasets_d / "*.xml"),
+        stream=True,
+        cache=ParseCache(tmp_path / "cache"),
+        lazy_load=True,
+    )
+    erddap.load(parse_only={datasets_d / "dataset1.xml", datasets_d / "dataset2.xml"})
+    assert erddap.cache.hits == 2
+    assert set(erddap.datasets) == {"dataset1", "dataset2"}
+    reference = Erddap(str(datasets_d / "*.xml"))
+    assert erddap.datasets_xml == reference.datasets_xml
+
+
+def test_erddap_warm_load_skips_parsing(tmp_path, monkeypatch):
+    Erddap("tests/data/datasets.d/*.xml", cache=ParseCache(tmp_path))
+    parsed = []
+    monkeypatch.setattr(
+        erddap_module,
+        "element_fromstring",
+        lambda xml: parsed.append(xml) or ET.fromstring(xml),
+    )
+    monkeypatch.setattr(
+        erddap_module,
+        "parse_datasets_xml",
+        lambda *args: parsed.append(args) or [],
+    )
+    erddap = Erddap("tests/data/datasets.d/*.xml", cache=ParseCache(tmp_path))
+    assert erddap.cache.hits == 4
+    # only the non dataset elements (<user>) are parsed back from the cache
+    assert len(parsed) == len(erddap.nodes) - len(erddap.datasets)
+    assert erddap.datasets["dataset1"].attrs
+    assert len(parsed) == len(erddap.nodes) - len(erddap.datasets)
+
+    # the tree parses the cached datasets on first access
+    assert len(erddap.tree) == len(erddap.nodes)
+    assert len(parsed) == len(erddap.nodes)
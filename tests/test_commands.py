@@ -1,8 +1,20 @@
+import json
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
 from pathlib import Path
 
+import pytest
 from click.testing import CliRunner
+from git import Repo
 
+from erddap_deploy import erddap as erddap_module
+from erddap_deploy import test as erddap_test_module
 from erddap_deploy.cli import cli
+from erddap_deploy.manifest import get_manifest_path
 
 TEST_REPO = "https://github.com/HakaiInstitute/erddap-deploy.git"
 
@@ -16,6 +28,21 @@ def run_cli(*args, env=None):
     return runner.invoke(cli, args, env=env, catch_exceptions=False)
 
 
+@pytest.fixture
+def datasets_repo(tmp_path):
+    """Local bare repository with the test datasets used as remote"""
+    source_path = tmp_path / "source"
+    shutil.copytree("tests/data", source_path / "tests/data")
+    source = Repo.init(source_path, initial_branch="main")
+    with source.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@test.com")
+    source.git.add(A=True)
+    source.git.commit(m="Add datasets")
+    source.clone(tmp_path / "remote.git", bare=True)
+    return str(tmp_path / "remote.git")
+
+
 def test_erddap_deploy_help():
     result = run_cli("--help")
     assert result.exit_code == 0
@@ -104,6 +131,378 @@ class TestErddapDeploySync:
         assert result.exit_code == 0
         assert (formated_hard_flag_dir / "dataset1-modified").exists()
 
+    def test_sync_manifest(self, tmp_path, datasets_repo):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        hard_flag_dir = tmp_path / "hardFlag"
+        hard_flag_dir.mkdir()
+        args = (
+            "--datasets-xml",
+            local_repo_path / "**/datasets.d/*.xml",
+            "--active-datasets-xml",
+            active_datasets_xml,
+            "sync",
+            "--repo-url",
+            datasets_repo,
+            "--local-repo-path",
+            local_repo_path,
+            "--hard-flag",
+            "--hard-flag-dir",
+            hard_flag_dir,
+        )
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert set(manifest["datasets"]) == {"dataset1", "dataset2", "dataset3"}
+        for flag in hard_flag_dir.glob("*"):
+            flag.unlink()
+
+        source_test_xml = local_repo_path / "tests/data/datasets.d/dataset1.xml"
+        source_test_xml.write_text(
+            source_test_xml.read_text().replace(">title<", ">title-modified<")
+        )
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        assert [flag.name for flag in hard_flag_dir.glob("*")] == ["dataset1"]
+        assert "title-modified" in active_datasets_xml.read_text()
+        new_manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert (
+            new_manifest["datasets"]["dataset1"]["digest"]
+            != manifest["datasets"]["dataset1"]["digest"]
+        )
+        assert new_manifest["datasets"]["dataset2"] == manifest["datasets"]["dataset2"]
+
+    def test_sync_save_failure(self, tmp_path, datasets_repo, monkeypatch):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        args = (
+            "--datasets-xml",
+            local_repo_path / "**/datasets.d/*.xml",
+            "--active-datasets-xml",
+            active_datasets_xml,
+            "sync",
+            "--repo-url",
+            datasets_repo,
+            "--local-repo-path",
+            local_repo_path,
+        )
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        manifest = get_manifest_path(active_datasets_xml).read_text()
+
+        source_test_xml = local_repo_path / "tests/data/datasets.d/dataset1.xml"
+        source_test_xml.write_text(
+            source_test_xml.read_text().replace(">title<", ">title-modified<")
+        )
+
+        def write_atomic(*args, **kwargs):
+            raise OSError("No space left on device")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(erddap_module, "write_atomic", write_atomic)
+            result = CliRunner().invoke(cli, args)
+        assert result.exit_code != 0
+        # the manifest isn't updated without the datasets.xml it describes
+        assert get_manifest_path(active_datasets_xml).read_text() == manifest
+
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        assert "title-modified" in active_datasets_xml.read_text()
+
+    @pytest.mark.parametrize("ignore_manifest", [False, True])
+    def test_sync_soft_flag(self, tmp_path, datasets_repo, ignore_manifest):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        flag_dir, hard_flag_dir = tmp_path / "flag", tmp_path / "hardFlag"
+        flag_dir.mkdir()
+        hard_flag_dir.mkdir()
+        args = (
+            "--datasets-xml",
+            local_repo_path / "**/datasets.d/*.xml",
+            "--active-datasets-xml",
+            active_datasets_xml,
+            "sync",
+            "--repo-url",
+            datasets_repo,
+            "--local-repo-path",
+            local_repo_path,
+            "--flag",
+            "--flag-dir",
+            flag_dir,
+            "--hard-flag-dir",
+            hard_flag_dir,
+        ) + (("--ignore-manifest",) if ignore_manifest else ())
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        for flag in [*flag_dir.glob("*"), *hard_flag_dir.glob("*")]:
+            flag.unlink()
+
+        datasets_d = local_repo_path / "tests/data/datasets.d"
+        dataset1, dataset2 = datasets_d / "dataset1.xml", datasets_d / "dataset2.xml"
+        dataset1.write_text(dataset1.read_text().replace(">title<", ">title-modified<"))
+        dataset2.write_text(
+            dataset2.read_text().replace("<schemaName>", "<schemaName>modified_")
+        )
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        assert [flag.name for flag in flag_dir.glob("*")] == ["dataset1"]
+        assert [flag.name for flag in hard_flag_dir.glob("*")] == ["dataset2"]
+
+    def test_sync_incremental(self, tmp_path, datasets_repo):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        hard_flag_dir = tmp_path / "hardFlag"
+        hard_flag_dir.mkdir()
+        args = (
+            "--datasets-xml",
+            local_repo_path / "**/datasets.d/*.xml",
+            "--active-datasets-xml",
+            active_datasets_xml,
+            "sync",
+            "--repo-url",
+            datasets_repo,
+            "--local-repo-path",
+            local_repo_path,
+            "--hard-flag",
+            "--hard-flag-dir",
+            hard_flag_dir,
+        )
+        result = run_cli(*args, "--incremental")
+        assert result.exit_code == 0, result.output
+        manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert manifest["commit"]
+        for flag in hard_flag_dir.glob("*"):
+            flag.unlink()
+
+        # modify, add and delete datasets files
+        datasets_d = local_repo_path / "tests/data/datasets.d"
+        dataset1 = datasets_d / "dataset1.xml"
+        dataset1.write_text(dataset1.read_text().replace(">title<", ">title-modified<"))
+        (datasets_d / "dataset4.xml").write_text(
+            dataset1.read_text().replace('datasetID="dataset1"', 'datasetID="dataset4"')
+        )
+        (datasets_d / "dataset3.xml").unlink()
+
+        result = run_cli(*args, "--incremental")
+        assert result.exit_code == 0, result.output
+        assert {flag.name for flag in hard_flag_dir.glob("*")} == {
+            "dataset1",
+            "dataset3",
+            "dataset4",
+        }
+        incremental_datasets_xml = active_datasets_xml.read_text()
+        assert "title-modified" in incremental_datasets_xml
+        assert 'datasetID="dataset3"' not in incremental_datasets_xml
+        new_manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert set(new_manifest["datasets"]) == {"dataset1", "dataset2", "dataset4"}
+        assert new_manifest["datasets"]["dataset2"] == manifest["datasets"]["dataset2"]
+
+        # same result as a full sync
+        result = run_cli(*args, "--ignore-manifest")
+        assert result.exit_code == 0, result.output
+        assert active_datasets_xml.read_text() == incremental_datasets_xml
+        full_manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert full_manifest["datasets"] == new_manifest["datasets"]
+
+    def test_sync_incremental_relative_glob(self, tmp_path, datasets_repo, monkeypatch):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+
+        def run_sync(datasets_xml):
+            return run_cli(
+                "--datasets-xml",
+                datasets_xml,
+                "--active-datasets-xml",
+                active_datasets_xml,
+                "sync",
+                "--repo-url",
+                datasets_repo,
+                "--local-repo-path",
+                local_repo_path,
+                "--incremental",
+            )
+
+        monkeypatch.chdir(tmp_path)
+        result = run_sync("datasets-repo/**/datasets.d/*.xml")
+        assert result.exit_code == 0, result.output
+        manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert all(
+            Path(dataset["source"]).is_absolute()
+            for dataset in manifest["datasets"].values()
+        )
+
+        # the same files globbed from another directory
+        (local_repo_path / "tests/data/datasets.d/dataset3.xml").unlink()
+        (tmp_path / "other").mkdir()
+        monkeypatch.chdir(tmp_path / "other")
+        result = run_sync("../datasets-repo/**/datasets.d/*.xml")
+        assert result.exit_code == 0, result.output
+        assert 'datasetID="dataset3"' not in active_datasets_xml.read_text()
+        new_manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+        assert set(new_manifest["datasets"]) == {"dataset1", "dataset2"}
+
+    def test_sync_incremental_test(self, tmp_path, datasets_repo, monkeypatch):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        args = (
+            "--datasets-xml",
+            local_repo_path / "**/datasets.d/*.xml",
+            "--active-datasets-xml",
+            active_datasets_xml,
+            "sync",
+            "--repo-url",
+            datasets_repo,
+            "--local-repo-path",
+            local_repo_path,
+            "--incremental",
+        )
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        dataset1 = local_repo_path / "tests/data/datasets.d/dataset1.xml"
+        dataset1.write_text(dataset1.read_text().replace(">title<", ">title-modified<"))
+
+        tested = []
+
+        def pytest_main(args, plugins):
+            tested.extend(plugins[0].erddap.datasets)
+            return pytest.ExitCode.OK
+
+        monkeypatch.setattr(erddap_test_module.pytest, "main", pytest_main)
+        result = run_cli(*args, "test")
+        assert result.exit_code == 0, result.output
+        # the sync only parsed dataset1.xml, all the datasets are tested
+        assert sorted(tested) == ["dataset1", "dataset2", "dataset3"]
+
+    def test_sync_watch(self, tmp_path, datasets_repo):
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        hard_flag_dir = tmp_path / "hardFlag"
+        hard_flag_dir.mkdir()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "erddap_deploy.cli",
+                "--datasets-xml",
+                str(local_repo_path / "**/datasets.d/*.xml"),
+                "--active-datasets-xml",
+                str(active_datasets_xml),
+                "sync",
+                "--repo-url",
+                datasets_repo,
+                "--local-repo-path",
+                str(local_repo_path),
+                "--hard-flag",
+                "--hard-flag-dir",
+                str(hard_flag_dir),
+                "--watch",
+                "--watch-interval",
+                "0.1",
+                "--watch-debounce",
+                "0.2",
+                "--status-port",
+                str(port),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        def wait_for_runs(runs):
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                assert process.poll() is None, "sync --watch exited"
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}") as response:
+                        status = json.loads(response.read())
+                    if status["runs"] >= runs:
+                        return status
+                except OSError:
+                    pass
+                time.sleep(0.1)
+            raise TimeoutError(f"sync --watch didn't run {runs} syncs")
+
+        try:
+            status = wait_for_runs(1)
+            assert status["state"] == "idle"
+            assert status["last_changes"] == 3
+            assert status["datasets"] == 3
+            for flag in hard_flag_dir.glob("*"):
+                flag.unlink()
+
+            dataset1 = local_repo_path / "tests/data/datasets.d/dataset1.xml"
+            dataset1.write_text(
+                dataset1.read_text().replace(">title<", ">title-modified<")
+            )
+            status = wait_for_runs(2)
+            assert status["state"] == "idle"
+            assert status["last_changes"] == 1
+            # the catalog kept in memory still holds the datasets not parsed again
+            assert status["datasets"] == 3
+            assert [flag.name for flag in hard_flag_dir.glob("*")] == ["dataset1"]
+            assert "title-modified" in active_datasets_xml.read_text()
+            manifest = json.loads(get_manifest_path(active_datasets_xml).read_text())
+            assert set(manifest["datasets"]) == {"dataset1", "dataset2", "dataset3"}
+        finally:
+            process.terminate()
+            assert process.wait(timeout=30) == 0
+
+    def test_sync_shallow_sparse_clone(self, tmp_path, datasets_repo):
+        Repo(datasets_repo).git.config("uploadpack.allowFilter", "true")
+        work = Repo.clone_from(datasets_repo, tmp_path / "work")
+        with work.config_writer() as config:
+            config.set_value("user", "name", "test")
+            config.set_value("user", "email", "test@test.com")
+
+        def push(path, content):
+            (tmp_path / "work" / path).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / "work" / path).write_text(content)
+            work.git.add(A=True)
+            work.git.commit(m=f"Update {path}")
+            work.git.push("origin", "main")
+
+        push("samples/large_file.nc", "x" * 10000)
+
+        active_datasets_xml = tmp_path / "datasets.xml"
+        local_repo_path = tmp_path / "datasets-repo"
+        args = (
+            "--datasets-xml",
+            local_repo_path / "**/datasets.d/*.xml",
+            "--active-datasets-xml",
+            active_datasets_xml,
+            "sync",
+            "--repo-url",
+            f"file://{datasets_repo}",
+            "--branch",
+            "main",
+            "--local-repo-path",
+            local_repo_path,
+            "--clone-depth",
+            "1",
+            "--single-branch",
+            "--clone-filter",
+            "blob:none",
+            "--sparse",
+        )
+        result = run_cli(*args)
+        assert result.exit_code == 0, result.output
+        repo = Repo(local_repo_path)
+        assert repo.git.rev_parse("--is-shallow-repository") == "true"
+        assert len(list(repo.iter_commits())) == 1
+        assert (local_repo_path / "tests/data/datasets.d/dataset1.xml").exists()
+        assert not (local_repo_path / "samples/large_file.nc").exists()
+        assert active_datasets_xml.read_text().count("<dataset ") == 3
+
+        dataset1 = tmp_path / "work/tests/data/datasets.d/dataset1.xml"
+        push(dataset1, dataset1.read_text().replace(">title<", ">title-modified<"))
+        result = run_cli(*args, "--pull")
+        assert result.exit_code == 0, result.output
+        assert "title-modified" in active_datasets_xml.read_text()
+        assert repo.git.rev_parse("--is-shallow-repository") == "true"
+        assert len(list(repo.iter_commits())) == 2
+
     def test_sync_hakai_datasets(self, tmp_path):
         active_datasets_xml = tmp_path / "datasets.xml"
         local_repo_path = tmp_path / "datasets-repo"
@@ -1,6 +1,12 @@
+import shutil
+import xml.etree.ElementTree as ET
+from glob import glob
+from pathlib import Path
+
 import pytest
+from loguru import logger
 
-from erddap_deploy.erddap import Erddap
+from erddap_deploy.erddap import Erddap, parse_datasets_xml, replace_secrets
 
 
 @pytest.fixture
@@ -133,3 +139,242 @@ def test_unique_datasets():
     )
     erddap.load()
     assert len(erddap.datasets) > 0
+
+
+def test_erddap_load_stream():
+    erddap = Erddap(
+        datasets_xml_dir="tests/data/datasets.d/**/*.xml",
+        recursive=True,
+        stream=True,
+    )
+    assert len(erddap.datasets) == 4
+    assert erddap.datasets_xml is None
+    assert erddap.tree is None
+    assert erddap.datasets["dataset1"].source.endswith("dataset1.xml")
+
+
+def test_erddap_load_stream_same_datasets():
+    erddap = Erddap(datasets_xml_dir="tests/data/datasets.d/**/*.xml")
+    erddap_stream = Erddap(
+        datasets_xml_dir="tests/data/datasets.d/**/*.xml", stream=True
+    )
+    assert list(erddap.datasets) == list(erddap_stream.datasets)
+    for dataset_id, dataset in erddap.datasets.items():
+        assert dataset.to_xml() == erddap_stream.datasets[dataset_id].to_xml()
+
+
+def test_erddap_iter_datasets():
+    erddap = Erddap(
+        datasets_xml_dir="tests/data/datasets.d/**/*.xml",
+        lazy_load=True,
+        secrets={"TEST_SECRET": "TEST_VALUE"},
+    )
+    datasets = list(erddap.iter_datasets())
+    assert [dataset.dataset_id for dataset in datasets] == list(
+        Erddap(datasets_xml_dir="tests/data/datasets.d/**/*.xml").datasets
+    )
+    assert not erddap.datasets
+    assert any("TEST_VALUE" in dataset.to_xml() for dataset in datasets)
+
+
+def test_save_stream_erddap_with_user(tmp_path):
+    erddap = Erddap(
+        datasets_xml_dir="tests/data/datasets.d/**/*.xml",
+        recursive=True,
+        stream=True,
+    )
+    erddap.save(tmp_path / "datasets.xml")
+    assert "<user" in (tmp_path / "datasets.xml").read_text()
+    assert len(Erddap(str(tmp_path / "datasets.xml")).datasets) == 4
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_erddap_load_root_split_across_files(tmp_path, stream):
+    datasets_d = tmp_path / "datasets.d"
+    datasets_d.mkdir()
+    datasets = [
+        Path(file).read_text() for file in sorted(glob("tests/data/datasets.d/*.xml"))
+    ]
+    (datasets_d / "000_header.xml").write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<erddapDatasets>\n' + datasets[0]
+    )
+    for index, dataset in enumerate(datasets[1:-1], 1):
+        (datasets_d / f"{index:03d}.xml").write_text(dataset)
+    (datasets_d / "999_footer.xml").write_text(datasets[-1] + "\n</erddapDatasets>\n")
+
+    erddap = Erddap(datasets_xml_dir=str(datasets_d / "*.xml"), stream=stream)
+    reference = Erddap(datasets_xml_dir="tests/data/datasets.d/*.xml")
+    assert set(erddap.datasets) == set(reference.datasets)
+    erddap.save(tmp_path / "datasets.xml")
+    assert len(Erddap(str(tmp_path / "datasets.xml")).datasets) == 3
+
+
+def test_erddap_load_parse_only_keeps_catalog(tmp_path):
+    datasets_d = tmp_path / "datasets.d"
+    shutil.copytree("tests/data/datasets.d", datasets_d)
+    erddap = Erddap(datasets_xml_dir=str(datasets_d / "*.xml"))
+    dataset2 = erddap.datasets["dataset2"]
+
+    dataset1 = datasets_d / "dataset1.xml"
+    dataset1.write_text(dataset1.read_text().replace(">title<", ">new title<"))
+    (datasets_d / "dataset3.xml").unlink()
+    erddap.load(parse_only={dataset1, datasets_d / "dataset3.xml"})
+    assert set(erddap.datasets) == {"dataset1", "dataset2"}
+    assert erddap.datasets["dataset1"].attrs["title"] == "new title"
+    # datasets of the files not parsed are kept from the previous load
+    assert erddap.datasets["dataset2"] is dataset2
+    assert not erddap.partial
+
+    # without a previous load, only the parsed files datasets are available
+    erddap = Erddap(datasets_xml_dir=str(datasets_d / "*.xml"), lazy_load=True)
+    erddap.load(parse_only={dataset1})
+    assert set(erddap.datasets) == {"dataset1"}
+    assert erddap.partial
+    erddap.load()
+    assert set(erddap.datasets) == {"dataset1", "dataset2"}
+    assert not erddap.partial
+
+
+def test_erddap_load_parse_only_failure_keeps_catalog(tmp_path):
+    datasets_d = tmp_path / "datasets.d"
+    shutil.copytree("tests/data/datasets.d", datasets_d)
+    erddap = Erddap(datasets_xml_dir=str(datasets_d / "*.xml"))
+    datasets = dict(erddap.datasets)
+
+    dataset1 = datasets_d / "dataset1.xml"
+    text = dataset1.read_text()
+    dataset1.write_text(text.replace("</dataset>", ""))
+    with pytest.raises(ValueError, match="Failed to parse"):
+        erddap.load(parse_only={dataset1})
+    assert erddap.datasets == datasets
+
+    dataset1.write_text(text.replace(">title<", ">new title<"))
+    erddap.load(parse_only={dataset1})
+    assert set(erddap.datasets) == set(datasets)
+    assert erddap.datasets["dataset1"].attrs["title"] == "new title"
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_erddap_load_jobs_same_output(tmp_path, executor):
+    erddap = Erddap(datasets_xml_dir="tests/data/datasets.d/**/*.xml")
+    erddap_jobs = Erddap(
+        datasets_xml_dir="tests/data/datasets.d/**/*.xml",
+        jobs=4,
+        executor=executor,
+    )
+    assert list(erddap_jobs.datasets) == list(erddap.datasets)
+    assert erddap_jobs.datasets_xml == erddap.datasets_xml
+    for source in ("original", "parsed"):
+        erddap.save(tmp_path / f"serial-{source}.xml", source=source)
+        erddap_jobs.save(tmp_path / f"jobs-{source}.xml", source=source)
+        assert (tmp_path / f"serial-{source}.xml").read_bytes() == (
+            tmp_path / f"jobs-{source}.xml"
+        ).read_bytes()
+
+
+def test_replace_secrets_single_pass():
+    text, counts = replace_secrets(
+        "SECRET SECRET_URL SECRET_URL_2 SECRET",
+        {"SECRET": "a", "SECRET_URL": "SECRET", "SECRET_URL_2": "c", "UNUSED": "d"},
+    )
+    assert text == "a SECRET c a"
+    assert counts == {"SECRET": 2, "SECRET_URL": 1, "SECRET_URL_2": 1}
+
+
+def test_replace_secrets_unused_warning(caplog):
+    handler_id = logger.add(caplog.handler, format="{message}")
+    Erddap(
+        datasets_xml_dir="tests/data/datasets.d/*.xml",
+        secrets={"TEST_SECRET": "TEST_VALUE", "UNUSED_SECRET": "value"},
+    )
+    logger.remove(handler_id)
+    assert "Secret UNUSED_SECRET not found in datasets.xml" in caplog.text
+    assert "Secret TEST_SECRET not found" not in caplog.text
+
+
+def test_dataset_digest_ignores_whitespace_and_attributes_order():
+    xml = Path("tests/data/datasets.d/dataset1.xml").read_text()
+    dataset = parse_datasets_xml(xml)[0]
+    reformatted = parse_datasets_xml(
+        xml.replace(
+            'type="EDDTableFromMultidimNcFiles" datasetID="dataset1"',
+            'datasetID="dataset1"  type="EDDTableFromMultidimNcFiles"',
+        ).replace("\t<fileDir>", "\n    <fileDir>")
+    )[0]
+    assert dataset.digest == reformatted.digest
+    assert dataset.compare(reformatted) == []
+
+
+def test_erddap_diff(tmp_path):
+    datasets_d = tmp_path / "datasets.d"
+    shutil.copytree("tests/data/datasets.d", datasets_d)
+    active = Erddap(str(datasets_d / "**/*.xml"))
+
+    (datasets_d / "dataset1.xml").write_text(
+        (datasets_d / "dataset1.xml")
+        .read_text()
+        .replace(">title<", ">new title<")
+        .replace("/datasets/dataset1/", "/datasets/new/")
+    )
+    (datasets_d / "dataset3.xml").unlink()
+    erddap = Erddap(str(datasets_d / "**/*.xml"))
+
+    diff = erddap.diff(active)
+    assert set(diff) == {"dataset1", "dataset3"}
+    assert diff["dataset3"] == [
+        dict(element="dataset", name="dataset3", action="removed")
+    ]
+    assert diff["dataset1"] == [
+        dict(
+            element="addAttributes",
+            name="title",
+            action="changed",
+            old="title",
+            new="new title",
+        ),
+        dict(
+            element="fileDir",
+            name="fileDir",
+            action="changed",
+            old="/datasets/dataset1/",
+            new="/datasets/new/",
+        ),
+    ]
+
+
+def test_save_atomic_skip_unchanged(tmp_path):
+    output = tmp_path / "datasets.xml"
+    erddap = Erddap(datasets_xml_dir="tests/data/datasets.d/**/*.xml")
+    assert erddap.save(output)
+    output.chmod(0o640)
+    mtime = output.stat().st_mtime_ns
+    assert not erddap.save(output)
+    assert output.stat().st_mtime_ns == mtime
+    assert erddap.save(output, source="parsed")
+    assert output.stat().st_mode & 0o777 == 0o640
+    assert [path.name for path in tmp_path.iterdir()] == ["datasets.xml"]
+
+
+def test_save_parsed_same_as_tree(tmp_path):
+    erddap = Erddap(datasets_xml_dir="tests/data/datasets.d/**/*.xml")
+    erddap.save(tmp_path / "datasets.xml", source="parsed")
+    assert (tmp_path / "datasets.xml").read_text() == (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        + ET.tostring(erddap.tree, encoding="UTF-8").decode("UTF-8")
+    )
+
+
+def test_dataset_variables_indexes():
+    dataset = Erddap("tests/data/datasets.d/*.xml").datasets["dataset1"]
+    assert list(dataset.variables_by_destination_name) == (
+        dataset.get_variables_destination_names()
+    )
+    assert list(dataset.variables_by_source_name) == (
+        dataset.get_variables_source_names()
+    )
+    variable = dataset.variables_by_destination_name["filename"]
+    assert variable.source_name == "filename"
+    assert dataset.variables_by_lower_destination_name["filename"] is variable
+    assert dataset.variables_by_destination_name is (
+        dataset.variables_by_destination_name
+    )
@@ -0,0 +1,182 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from erddap_deploy.erddap import Dataset, Erddap
+from erddap_deploy.flags import FlagScheduler, get_flag_type
+
+
+@pytest.fixture
+def erddap():
+    return Erddap(datasets_xml_dir="tests/data/datasets.d/*.xml", recursive=False)
+
+
+def modify(tmp_path, old, new):
+    source = tmp_path / "datasets.d"
+    source.mkdir()
+    for file in ("dataset1.xml", "dataset2.xml", "dataset3.xml"):
+        text = open(f"tests/data/datasets.d/{file}").read()
+        (source / file).write_text(
+            text.replace(old, new) if file == "dataset1.xml" else text
+        )
+    return Erddap(datasets_xml_dir=str(source / "*.xml"), recursive=False)
+
+
+@pytest.mark.parametrize(
+    "old,new,flag_type",
+    [
+        (">title<", ">title-modified<", "soft"),
+        ('<att name="units">', '<att name="units">m', "soft"),
+        ("<fileDir>", "<fileDir>/modified", "hard"),
+        ("<destinationName>time<", "<destinationName>time2<", "hard"),
+    ],
+)
+def test_flag_type_from_diff(erddap, tmp_path, old, new, flag_type):
+    modified = modify(tmp_path, old, new)
+    diff = modified.diff(erddap)
+    assert list(diff) == ["dataset1"]
+    assert get_flag_type(diff["dataset1"]) == flag_type
+    # the structure digest gives the same classification without the full diff
+    dataset, modified_dataset = (
+        erddap.datasets["dataset1"],
+        modified.datasets["dataset1"],
+    )
+    assert (dataset.structure_digest == modified_dataset.structure_digest) == (
+        flag_type == "soft"
+    )
+
+
+def test_flag_type_added_dataset():
+    assert get_flag_type(None) == "hard"
+    assert (
+        get_flag_type([dict(element="dataset", name="dataset1", action="added")])
+        == "hard"
+    )
+
+
+AXIS_DATASET = """
+<dataset type="EDDGridFromNcFiles" datasetID="grid">
+    <fileDir>/data</fileDir>
+    <axisVariable>
+        <sourceName>depth</sourceName>
+        <addAttributes><att name="units">m</att></addAttributes>
+    </axisVariable>
+</dataset>
+"""
+
+
+@pytest.mark.parametrize(
+    "old,new,flag_type",
+    [
+        (">m<", ">meters<", "soft"),
+        (">depth<", ">z<", "hard"),
+    ],
+)
+def test_flag_type_axis_variable(old, new, flag_type):
+    dataset = Dataset(ET.fromstring(AXIS_DATASET))
+    modified = Dataset(ET.fromstring(AXIS_DATASET.replace(old, new)))
+    assert get_flag_type(modified.compare(dataset)) == flag_type
+    # same classification from the structure digest used with the manifest
+    assert (dataset.structure_digest == modified.structure_digest) == (
+        flag_type == "soft"
+    )
+
+
+def test_flag_scheduler_run(tmp_path):
+    flag_dir, hard_flag_dir = tmp_path / "flag", tmp_path / "hardFlag"
+    flag_dir.mkdir()
+    hard_flag_dir.mkdir()
+    diff = {
+        "dataset1": [dict(element="addAttributes", name="title", action="changed")],
+        "dataset2": [dict(element="fileDir", name="fileDir", action="changed")],
+    }
+    scheduler = FlagScheduler(flag_dir, hard_flag_dir)
+    flags = scheduler.run(diff)
+    assert flags == {"soft": ["dataset1"], "hard": ["dataset2"]}
+    assert (flag_dir / "dataset1").exists()
+    assert (hard_flag_dir / "dataset2").exists()
+
+    flags = scheduler.run(diff, force_hard=True)
+    assert flags == {"soft": [], "hard": ["dataset1", "dataset2"]}
+
+
+METADATA_CHANGE = [dict(element="addAttributes", name="title", action="changed")]
+STRUCTURE_CHANGE = [dict(element="fileDir", name="fileDir", action="changed")]
+
+
+def test_flag_scheduler_batches(erddap):
+    diff = {
+        "dataset1": STRUCTURE_CHANGE,
+        "dataset2": STRUCTURE_CHANGE,
+        "dataset3": METADATA_CHANGE,
+        "removed": STRUCTURE_CHANGE,
+    }
+    scheduler = FlagScheduler(batch_size=2, priority=["EDDTableFromDatabase"])
+    batches = scheduler.schedule(diff, erddap.datasets)
+    assert batches == [
+        [("soft", "dataset3"), ("hard", "dataset2")],
+        [("hard", "removed"), ("hard", "dataset1")],
+    ]
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        StatusHandler.requests += 1
+        self.send_response(503 if StatusHandler.requests < 3 else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def status_url():
+    StatusHandler.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/erddap/status.html"
+    server.shutdown()
+    server.server_close()
+
+
+def test_flag_scheduler_wait(tmp_path, status_url):
+    flag_dir, hard_flag_dir = tmp_path / "flag", tmp_path / "hardFlag"
+    flag_dir.mkdir()
+    hard_flag_dir.mkdir()
+    processed = []
+
+    def erddap_process_flags():
+        # mimic ERDDAP consuming the flags
+        end = time.monotonic() + 5
+        while time.monotonic() < end and len(processed) < 3:
+            for flag in [*flag_dir.glob("*"), *hard_flag_dir.glob("*")]:
+                processed.append((flag.name, len(list(hard_flag_dir.glob("*")))))
+                flag.unlink()
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=erddap_process_flags)
+    thread.start()
+    scheduler = FlagScheduler(
+        flag_dir,
+        hard_flag_dir,
+        batch_size=1,
+        wait=True,
+        status_url=status_url,
+        timeout=5,
+        poll_interval=0.02,
+    )
+    flags = scheduler.run(
+        {"dataset1": STRUCTURE_CHANGE, "dataset2": STRUCTURE_CHANGE, "dataset3": None}
+    )
+    thread.join()
+    assert flags == {"soft": [], "hard": ["dataset1", "dataset2", "dataset3"]}
+    # a single flag is available at a time
+    assert [name for name, _ in processed] == ["dataset1", "dataset2", "dataset3"]
+    assert all(pending == 1 for _, pending in processed)
+    assert StatusHandler.requests >= 3
@@ -0,0 +1,318 @@
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from erddap_deploy.erddap import Dataset, Erddap
+from erddap_deploy.fake_uptime_kuma import FakeUptimeKumaApi
+from erddap_deploy.monitor import (
+    RetryPolicy,
+    get_changed_datasets,
+    load_monitor_state,
+    uptime_kuma_monitor,
+)
+from erddap_deploy.monitor_rules import MonitorRules
+
+ERDDAP_URL = "https://erddap.example.org/erddap"
+
+
+@pytest.fixture
+def datasets():
+    erddap = Erddap(datasets_xml_dir="tests/data/datasets.d/*.xml", recursive=False)
+    return list(erddap.datasets.values())
+
+
+def run_monitor(api, datasets, **kwargs):
+    uptime_kuma_monitor(
+        None,
+        erddap_url=ERDDAP_URL,
+        datasets=datasets,
+        api=api,
+        retry_policy=RetryPolicy(backoff=0),
+        **kwargs,
+    )
+
+
+def test_monitor_add_monitors(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets)
+    path_names = {monitor["pathName"] for monitor in api.monitors.values()}
+    assert "erddap.example.org/erddap" in path_names
+    assert "erddap.example.org/erddap / index.html" in path_names
+    assert "erddap.example.org/erddap / tabledap/dataset1.html" in path_names
+    assert api.calls["add_monitor"] == len(api.monitors)
+    assert api.calls["get_monitors"] == 1
+    assert api.calls["save_status_page"] == 1
+    page = api.status_pages["erddap-example-org"]
+    assert sum(len(group["monitorList"]) for group in page["publicGroupList"]) == (
+        len(api.monitors) - 1
+    )
+
+
+def test_monitor_rerun_is_noop(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets)
+    n_monitors = len(api.monitors)
+    api.calls.clear()
+    run_monitor(api, datasets)
+    assert len(api.monitors) == n_monitors
+    assert not api.calls["add_monitor"]
+    assert not api.calls["edit_monitor"]
+    assert not api.calls["pause_monitor"]
+    assert not api.calls["save_status_page"]
+
+
+def test_monitor_pause_inactive_dataset(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets)
+    datasets[0].active = False
+    run_monitor(api, datasets)
+    paused = [monitor for monitor in api.monitors.values() if not monitor["active"]]
+    assert paused
+    assert all(datasets[0].dataset_id in monitor["name"] for monitor in paused)
+
+
+def test_monitor_add_inactive_dataset_paused(datasets):
+    api = FakeUptimeKumaApi()
+    datasets[0].active = False
+    run_monitor(api, datasets)
+    monitors = {
+        monitor["name"]: monitor["active"]
+        for monitor in api.monitors.values()
+        if monitor["type"] != "group"
+    }
+    assert monitors[f"tabledap/{datasets[0].dataset_id}.html"] is False
+    assert monitors[f"tabledap/{datasets[1].dataset_id}.html"] is True
+    assert monitors["index.html"] is True
+
+    # an incremental rerun leaves it paused
+    api.calls.clear()
+    run_monitor(api, datasets, changed_datasets={datasets[0].dataset_id})
+    assert not api.calls["resume_monitor"]
+    assert not api.calls["pause_monitor"]
+
+
+def test_monitor_parallel_with_failures(datasets):
+    api = FakeUptimeKumaApi(failure_rate=0.3, fail_methods=("add_monitor",), seed=1)
+    run_monitor(api, datasets, parallelism=4)
+    reference = FakeUptimeKumaApi()
+    run_monitor(reference, datasets)
+    assert len(api.monitors) == len(reference.monitors)
+    assert api.calls["add_monitor"] > reference.calls["add_monitor"]
+
+
+def test_monitor_add_lost_responses_no_duplicates(datasets):
+    api = FakeUptimeKumaApi(
+        failure_rate=0.3, fail_methods=("add_monitor",), seed=1, lost_responses=True
+    )
+    run_monitor(api, datasets, parallelism=4)
+    reference = FakeUptimeKumaApi()
+    run_monitor(reference, datasets)
+    assert sorted(monitor["pathName"] for monitor in api.monitors.values()) == sorted(
+        monitor["pathName"] for monitor in reference.monitors.values()
+    )
+    # monitors created by a timed out attempt are looked up instead of added again
+    assert api.calls["get_monitors"] > reference.calls["get_monitors"]
+
+
+def test_monitor_delete_monitors(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets)
+    run_monitor(api, datasets, delete_monitors=r".*dataset1.*")
+    assert api.monitors
+    assert not any("dataset1" in monitor["name"] for monitor in api.monitors.values())
+
+
+def test_monitor_incremental(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets[:2])
+    api.calls.clear()
+    run_monitor(api, datasets, changed_datasets={datasets[2].dataset_id})
+    assert api.calls["add_monitor"] == 1
+    added = api.monitors[max(api.monitors)]
+    assert datasets[2].dataset_id in added["name"]
+
+
+def test_monitor_incremental_orphans(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets)
+    n_monitors = len(api.monitors)
+    api.calls.clear()
+    run_monitor(api, datasets[1:], changed_datasets={datasets[0].dataset_id})
+    assert not api.calls["add_monitor"]
+    assert len(api.monitors) == n_monitors
+
+
+def test_monitor_incremental_full_reconcile(datasets, tmp_path):
+    state_file = tmp_path / "state.json"
+    api = FakeUptimeKumaApi()
+    run_monitor(
+        api,
+        datasets,
+        changed_datasets=set(),
+        state_file=state_file,
+        full_reconcile_interval=24,
+    )
+    # no previous full reconciliation: every monitor is added
+    assert api.calls["add_monitor"] == len(api.monitors)
+    assert state_file.exists()
+
+    # a dataset monitor deleted outside of a changed dataset is only restored
+    # by the next full reconciliation
+    dataset_monitor = next(
+        id_ for id_, monitor in api.monitors.items() if "dataset1" in monitor["name"]
+    )
+    del api.monitors[dataset_monitor]
+    api.calls.clear()
+    kwargs = dict(changed_datasets=set(), state_file=state_file)
+    run_monitor(api, datasets, full_reconcile_interval=24, **kwargs)
+    assert not api.calls["add_monitor"]
+    run_monitor(api, datasets, full_reconcile_interval=0, **kwargs)
+    assert api.calls["add_monitor"] == 1
+
+
+def test_monitor_state_changed_datasets(datasets, tmp_path):
+    state_file = tmp_path / "state.json"
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets[:2], state_file=state_file)
+    state = load_monitor_state(state_file)
+    assert set(state["datasets"]) == {dataset.dataset_id for dataset in datasets[:2]}
+    assert get_changed_datasets(datasets[:2], state) == set()
+    assert get_changed_datasets(datasets[1:], state) == {
+        datasets[0].dataset_id,
+        datasets[2].dataset_id,
+    }
+    assert get_changed_datasets(datasets, {}) is None
+
+
+def test_monitor_state_save_failure(datasets, tmp_path):
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets, state_file=not_a_directory / "state.json")
+    # the status page is still maintained
+    assert api.calls["save_status_page"] == 1
+
+
+def test_monitor_status_page_updated_on_change(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets[:2])
+    api.calls.clear()
+    run_monitor(api, datasets)
+    assert api.calls["save_status_page"] == 1
+    page = api.status_pages["erddap-example-org"]
+    dataset_monitors = page["publicGroupList"][1]["monitorList"]
+    assert len(dataset_monitors) == len(datasets)
+
+
+def test_monitor_status_page_max_group_size(datasets):
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets, max_group_size=2)
+    groups = api.status_pages["erddap-example-org"]["publicGroupList"]
+    assert [group["name"] for group in groups] == [
+        "ERDDAP Pages (1/2)",
+        "ERDDAP Pages (2/2)",
+        "ERDDAP Datasets (1/2)",
+        "ERDDAP Datasets (2/2)",
+        "ERDDAP Realtime Datasets",
+    ]
+    assert all(len(group["monitorList"]) <= 2 for group in groups)
+
+
+@pytest.mark.parametrize(
+    "dataset_id,realtime",
+    [
+        ("station_realtime", True),
+        ("station_Real-Time", True),
+        ("station_5min", True),
+        ("station_archive", False),
+    ],
+)
+def test_monitor_rules_default(dataset_id, realtime):
+    dataset = Dataset(
+        ET.Element("dataset", type="EDDTableFromNcFiles", datasetID=dataset_id)
+    )
+    monitors = MonitorRules().get_monitors(dataset)
+    assert monitors["page"] == {"interval": 60}
+    assert ("realtime" in monitors) == realtime
+
+
+def test_monitor_rules_config(datasets, tmp_path):
+    config = tmp_path / "uptimekuma.json"
+    config.write_text(
+        json.dumps(
+            {
+                "pages": {"interval": 300},
+                "rules": [
+                    {"monitors": {"page": {"interval": 3600}}},
+                    {
+                        "attributes": {"cdm_data_type": "^TimeSeries$"},
+                        "monitors": {"realtime": {"interval": 600, "dt": "2hours"}},
+                    },
+                    {"datasetID": "dataset3", "monitors": {"page": None}},
+                ],
+            }
+        )
+    )
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets, monitor_rules=MonitorRules.from_file(config))
+    monitors = {
+        monitor["name"]: monitor["interval"]
+        for monitor in api.monitors.values()
+        if monitor["type"] != "group"
+    }
+    assert monitors == {
+        "index.html": 300,
+        "tabledap/index.html": 300,
+        "griddap/index.html": 300,
+        "tabledap/dataset1.html": 3600,
+        "tabledap/dataset2.html": 3600,
+        "tabledap/dataset2.htmlTable?&time>now-2hours": 600,
+        "tabledap/dataset3.htmlTable?&time>now-2hours": 600,
+    }
+
+
+def test_monitor_rules_unknown_kind():
+    with pytest.raises(ValueError):
+        MonitorRules({"rules": [{"monitors": {"graph": {}}}]})
+
+
+def make_datasets(n_datasets):
+    return [
+        Dataset(
+            ET.Element("dataset", type="EDDTableFromNcFiles", datasetID=f"dataset_{i}")
+        )
+        for i in range(n_datasets)
+    ]
+
+
+def test_monitor_load_budget():
+    datasets = make_datasets(1000)
+    api = FakeUptimeKumaApi()
+    run_monitor(api, datasets, max_requests_per_minute=103, interval_spread=0.2)
+    intervals = [
+        monitor["interval"]
+        for monitor in api.monitors.values()
+        if monitor["type"] != "group" and "index.html" not in monitor["name"]
+    ]
+    # 1000 dataset monitors at 60s scaled by 16 (10 rounded up to a power of 2)
+    # to fit 100 requests/min, then spread
+    assert min(intervals) >= 960
+    assert max(intervals) <= 1152
+    assert len(set(intervals)) > 50
+    requests_per_minute = sum(
+        60 / monitor["interval"]
+        for monitor in api.monitors.values()
+        if monitor["type"] != "group"
+    )
+    assert requests_per_minute <= 103
+
+
+def test_monitor_load_budget_stable_on_growth():
+    api = FakeUptimeKumaApi()
+    kwargs = dict(max_requests_per_minute=103, interval_spread=0.2)
+    run_monitor(api, make_datasets(1000), **kwargs)
+    api.calls.clear()
+    run_monitor(api, make_datasets(1001), **kwargs)
+    assert api.calls["add_monitor"] == 1
+    assert not api.calls["edit_monitor"]
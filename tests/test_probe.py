@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from click.testing import CliRunner
+
+from erddap_deploy.cli import cli
+from erddap_deploy.erddap import Erddap
+from erddap_deploy.monitor_rules import MonitorRules
+from erddap_deploy.probe import MAX_REDIRECTS, probe_erddap, probe_urls, summarize
+
+
+class ErddapStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    paths = []
+
+    def setup(self):
+        super().setup()
+        ErddapStubHandler.connections += 1
+
+    def do_GET(self):
+        ErddapStubHandler.paths.append(self.path)
+        if self.path in ("/erddap/204", "/erddap/304"):
+            # no body nor framing headers, the connection is kept alive
+            self.send_response_only(100)
+            self.end_headers()
+            self.send_response(int(self.path[-3:]))
+            self.end_headers()
+            return
+        status = 404 if "dataset2" in self.path else 200
+        body = b"<html>ok</html>"
+        if self.path in ("/erddap/tabledap/dataset3.html", "/erddap/loop"):
+            status = 302
+        self.send_response(status)
+        if self.path == "/erddap/tabledap/dataset3.html":
+            self.send_header("Location", "/erddap/moved/dataset3.html")
+        elif self.path == "/erddap/loop":
+            self.send_header("Location", "loop")
+        if "griddap" in self.path:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def erddap_url():
+    ErddapStubHandler.connections = 0
+    ErddapStubHandler.paths = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ErddapStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/erddap"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def datasets():
+    erddap = Erddap(datasets_xml_dir="tests/data/datasets.d/*.xml", recursive=False)
+    return list(erddap.datasets.values())
+
+
+def test_probe_erddap(erddap_url, datasets):
+    results = probe_erddap(erddap_url, datasets, concurrency=1)
+    status = {result["name"]: result["status"] for result in results}
+    assert status == {
+        "index.html": 200,
+        "tabledap/index.html": 200,
+        "griddap/index.html": 200,
+        "tabledap/dataset1.html": 200,
+        "tabledap/dataset2.html": 404,
+        "tabledap/dataset3.html": 200,
+    }
+    # a single connection is kept alive with one request at a time
+    assert ErddapStubHandler.connections == 1
+    summary = summarize(results)
+    assert summary["total"] == 6
+    assert summary["failed"] == 1
+    assert summary["status"] == {"200": 5, "404": 1}
+    assert summary["latency"]["p50"] <= summary["latency"]["max"]
+
+
+def test_probe_erddap_encoded_query(erddap_url, datasets, tmp_path):
+    config = tmp_path / "uptimekuma.json"
+    config.write_text(json.dumps({"rules": [{"monitors": {"realtime": {}}}]}))
+    results = probe_erddap(
+        erddap_url, datasets, monitor_rules=MonitorRules.from_file(config)
+    )
+    assert all(result["ok"] for result in results if "dataset2" not in result["url"])
+    assert "/erddap/tabledap/dataset1.htmlTable?&time%3Enow-1day" in (
+        ErddapStubHandler.paths
+    )
+
+
+def test_probe_redirects(erddap_url, datasets):
+    results = {result["name"]: result for result in probe_erddap(erddap_url, datasets)}
+    assert results["tabledap/dataset3.html"]["ok"]
+    assert results["tabledap/dataset3.html"]["redirects"] == [
+        f"{erddap_url}/moved/dataset3.html"
+    ]
+
+    # redirects are only followed up to MAX_REDIRECTS times
+    (result,) = asyncio.run(probe_urls([dict(name="loop", url=f"{erddap_url}/loop")]))
+    assert result["status"] == 302
+    assert not result["ok"]
+    assert len(result["redirects"]) == MAX_REDIRECTS
+
+
+def test_probe_no_body_status(erddap_url):
+    monitors = [
+        dict(name=status, url=f"{erddap_url}/{status}") for status in ("204", "304")
+    ]
+    results = asyncio.run(probe_urls(monitors, concurrency=1, timeout=2))
+    assert [(result["status"], result["size"]) for result in results] == [
+        (204, 0),
+        (304, 0),
+    ]
+    assert not any(result["error"] for result in results)
+    assert ErddapStubHandler.connections == 1
+
+
+def test_probe_unreachable(datasets):
+    results = probe_erddap("http://127.0.0.1:9/erddap", datasets[:1], timeout=2)
+    assert not any(result["ok"] for result in results)
+    assert all(result["error"] for result in results)
+
+
+def test_probe_command(erddap_url, tmp_path):
+    output = tmp_path / "probe.json"
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        [
+            "--datasets-xml",
+            "tests/data/datasets.d/*.xml",
+            "--active-datasets-xml",
+            str(tmp_path / "datasets.xml"),
+            "probe",
+            "--erddap-url",
+            erddap_url,
+            "--output",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 1
+    report = json.loads(output.read_text())
+    assert report["summary"]["failed"] == 1
+    assert len(report["results"]) == 6
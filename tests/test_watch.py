@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from erddap_deploy.watch import SyncWatcher
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timeout"
+        time.sleep(0.01)
+
+
+def get_status(watcher):
+    host, port = watcher.server.server_address[:2]
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/") as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def start_watcher(tmp_path, sync):
+    datasets_d = tmp_path / "datasets.d"
+    datasets_d.mkdir()
+    (datasets_d / "dataset1.xml").write_text("<dataset/>")
+    watcher = SyncWatcher(
+        sync,
+        lambda: [str(file) for file in datasets_d.glob("*.xml")],
+        interval=0.05,
+        debounce=0.3,
+        status_port=0,
+    )
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    wait_for(lambda: watcher.server and watcher.get_status()["runs"] == 1)
+    return watcher, thread, datasets_d
+
+
+def test_watch_debounce_changes(tmp_path):
+    syncs = []
+    watcher, thread, datasets_d = start_watcher(
+        tmp_path, lambda: syncs.append(time.monotonic()) or {"dataset1": None}
+    )
+    try:
+        status, body = get_status(watcher)
+        assert status == 200
+        assert body["state"] == "idle"
+        assert body["last_changes"] == 1
+        assert body["last_duration"] is not None
+
+        # a burst of changes only triggers a single sync
+        for index in range(5):
+            (datasets_d / f"dataset{index}.xml").write_text(f"<dataset id='{index}'/>")
+            time.sleep(0.05)
+        wait_for(lambda: watcher.get_status()["runs"] == 2)
+        time.sleep(0.5)
+        assert len(syncs) == 2
+    finally:
+        watcher.stop()
+        thread.join()
+
+
+def test_watch_sync_error(tmp_path):
+    def sync():
+        raise RuntimeError("sync error")
+
+    watcher, thread, _ = start_watcher(tmp_path, sync)
+    try:
+        status, body = get_status(watcher)
+        assert status == 503
+        assert body["state"] == "error"
+        assert "sync error" in body["last_error"]
+        assert body["last_success"] is None
+    finally:
+        watcher.stop()
+        thread.join()